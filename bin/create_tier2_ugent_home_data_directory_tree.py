@@ -24,7 +24,7 @@ import os
 import configparser
 
 from vsc.filesystem.gpfs import GpfsOperations
-from vsc.config.base import VscStorage
+from vsc.config.base import VscStorage, VSC_HOME
 
 QUOTA_CONF_FILE = '/etc/quota_check.conf'
 
@@ -78,7 +78,7 @@ def main():
         filesystem_name = storage_settings[storage_name].filesystem
         filesystem_info = gpfs.get_filesystem_info(filesystem_name)
 
-        if storage_name in ('VSC_HOME'):
+        if storage_name == VSC_HOME:
             set_up_filesystem(gpfs, storage_settings, storage_name, filesystem_info, filesystem_name)
             set_up_apps(gpfs, storage_settings, storage_name, filesystem_info, filesystem_name)
         else:
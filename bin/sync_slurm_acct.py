@@ -22,12 +22,15 @@ The script must result in an idempotent execution, to ensure nothing breaks.
 import logging
 import sys
 
+from datetime import timedelta
+
 from vsc.accountpage.client import AccountpageClient
 from vsc.accountpage.wrappers import mkVo
 from vsc.administration.slurm.sacctmgr import get_slurm_sacct_info, SacctMgrTypes
 from vsc.administration.slurm.sync import (
-    execute_commands, slurm_institute_accounts, slurm_vo_accounts, slurm_user_accounts,
+    MAX_PARALLEL_COMMANDS, execute_commands, slurm_institute_accounts, slurm_vo_accounts, slurm_user_accounts,
     )
+from vsc.administration.tools import retry_request
 from vsc.config.base import GENT, VSC_SLURM_CLUSTERS, INSTITUTE_VOS_BY_INSTITUTE, PRODUCTION, PILOT
 from vsc.utils.nagios import NAGIOS_EXIT_CRITICAL
 from vsc.utils.script_tools import ExtendedSimpleOption
@@ -41,10 +44,59 @@ SYNC_SLURM_ACCT_LOGFILE = f"/var/log/{NAGIOS_HEADER}.log"
 
 MAX_USERS_JOB_CANCEL = 10
 
+# look a bit further back for changes than the last sync, to cover clock skew with the account page.
+# Keep this short: the changes in the overlap were already synced and would otherwise trigger a sync on every run.
+SYNC_TIMESTAMP_OVERLAP = timedelta(minutes=10)
+# sync anyway when the last sync is this long ago, to fix drift on the Slurm side and to pick up changes
+# that do not show up as modified VOs or accounts, e.g., VO membership changes.
+# The script runs from cron every 15 minutes, so this is a full sync every 24 runs at most. This is independent
+# of the nagios threshold, runs that skip the sync still report to nagios.
+FULL_SYNC_INTERVAL_MINUTES = 6 * 60
+
 class SyncSanityError(Exception):
     pass
 
 
+def account_page_changed(client, host_institute, timestamp):
+    """Check if any of the institute's VOs or any account was modified in the account page since the timestamp.
+
+    This only fetches the changes, which is a lot cheaper than fetching all VOs and accounts.
+    """
+    changed_vos = retry_request(client.vo.institute[host_institute].modified[timestamp].get)[1]
+    changed_accounts = retry_request(client.account.modified[timestamp].get)[1]
+
+    logging.info("Found %d %s VOs and %d accounts that have changed in the accountpage since %s",
+                 len(changed_vos), host_institute, len(changed_accounts), timestamp)
+
+    return bool(changed_vos or changed_accounts)
+
+
+def sync_needed(client, host_institute, last_timestamp, start_time, full_sync=False,
+                full_sync_interval=timedelta(minutes=FULL_SYNC_INTERVAL_MINUTES)):
+    """Decide whether the Slurm accounts need to be synced.
+
+    A sync is needed when it is forced, when the last sync is at least full_sync_interval ago, or when
+    anything changed in the account page since the last sync (minus SYNC_TIMESTAMP_OVERLAP).
+    """
+    if full_sync:
+        logging.info("Full sync requested")
+        return True
+
+    # go through the LDAP timestamps, so both datetimes are comparable
+    (last_datetime, _) = convert_timestamp(convert_timestamp(last_timestamp)[1])
+    (start_datetime, _) = convert_timestamp(convert_timestamp(start_time)[1])
+    if start_datetime - last_datetime >= full_sync_interval:
+        logging.info("Last sync at %s is more than %s ago, doing a full sync", last_timestamp, full_sync_interval)
+        return True
+
+    (_, changed_timestamp) = convert_timestamp(last_datetime - SYNC_TIMESTAMP_OVERLAP)
+    if account_page_changed(client, host_institute, changed_timestamp):
+        return True
+
+    logging.info("Nothing changed in the account page since %s, not syncing", changed_timestamp)
+    return False
+
+
 def main():
     """
     Main script. The usual.
@@ -80,6 +132,18 @@ def main():
             'store_true',
             False
         ),
+        'full_sync': (
+            'Sync all VOs and accounts, even if nothing changed in the account page since the last sync',
+            None,
+            'store_true',
+            False
+        ),
+        'full_sync_interval': (
+            'Minutes after the last sync to sync again, even if nothing changed in the account page',
+            int,
+            'store',
+            FULL_SYNC_INTERVAL_MINUTES
+        ),
     }
 
     opts = ExtendedSimpleOption(options)
@@ -95,6 +159,17 @@ def main():
         client = AccountpageClient(token=opts.options.access_token, url=opts.options.account_page_url + "/api/")
         host_institute = opts.options.host_institute
 
+        # The removal of users requires the complete list of VOs and accounts, so we only use the changes
+        # to decide whether a sync is needed at all. The timestamp is not updated when skipping the sync.
+        if not sync_needed(client, host_institute, last_timestamp, start_time,
+                           full_sync=opts.options.full_sync,
+                           full_sync_interval=timedelta(minutes=opts.options.full_sync_interval)):
+            if opts.options.dry_run:
+                logging.info("Dry run done, nothing to sync")
+            else:
+                opts.epilogue("Accounts synced to slurm, nothing changed", stats)
+            return
+
         slurm_account_info = get_slurm_sacct_info(SacctMgrTypes.accounts)
         slurm_user_info = get_slurm_sacct_info(SacctMgrTypes.users)
 
@@ -108,10 +183,9 @@ def main():
                 for p in opts.options.cluster_classes
                 for cs in VSC_SLURM_CLUSTERS[host_institute][p]
             ]
-        sacctmgr_commands = []
 
         # All users belong to a VO, so fetching the VOs is necessary/
-        account_page_vos = [mkVo(v) for v in client.vo.institute[opts.options.host_institute].get()[1]]
+        account_page_vos = [mkVo(v) for v in retry_request(client.vo.institute[opts.options.host_institute].get)[1]]
 
         # make sure the institutes and the default accounts (VOs) are there for each cluster
         institute_vos = {
@@ -119,16 +193,16 @@ def main():
             for v in account_page_vos
             if v.vsc_id in INSTITUTE_VOS_BY_INSTITUTE[host_institute].values()
         }
-        sacctmgr_commands += slurm_institute_accounts(slurm_account_info, clusters, host_institute, institute_vos)
+        institute_commands = slurm_institute_accounts(slurm_account_info, clusters, host_institute, institute_vos)
 
         # The VOs do not track active state of users, so we need to fetch all accounts as well
-        active_accounts = {a["vsc_id"] for a in client.account.get()[1] if a["isactive"]}
+        active_accounts = {a["vsc_id"] for a in retry_request(client.account.get)[1] if a["isactive"]}
 
         # dictionary mapping the VO vsc_id on a tuple with the VO members and the VO itself
-        account_page_members = {vo.vsc_id: (set(vo.members), vo) for vo in account_page_vos}
+        account_page_members = {vo.vsc_id: (frozenset(vo.members), vo) for vo in account_page_vos}
 
         # process all regular VOs
-        sacctmgr_commands += slurm_vo_accounts(account_page_vos, slurm_account_info, clusters, host_institute)
+        vo_commands = slurm_vo_accounts(account_page_vos, slurm_account_info, clusters, host_institute)
 
         # process VO members
         (job_cancel_commands, user_commands, association_remove_commands) = slurm_user_accounts(
@@ -140,14 +214,19 @@ def main():
         )
 
         # Adding users takes priority
-        sacctmgr_commands += user_commands
+        sacctmgr_commands = institute_commands + vo_commands + user_commands
 
         if opts.options.dry_run:
             print("Commands to be executed:\n")
             print("\n".join([" ".join(c) for c in sacctmgr_commands]))
         else:
             logging.info("Executing %d commands", len(sacctmgr_commands))
-            execute_commands(sacctmgr_commands)
+            # the default VO accounts are children of the institute accounts, so keep these in order
+            execute_commands(institute_commands)
+            # regular VO accounts only depend on the institute accounts
+            execute_commands(vo_commands, max_workers=MAX_PARALLEL_COMMANDS)
+            # moving a user requires adding the new association before changing the default account
+            execute_commands(user_commands)
 
 
         # safety to avoid emptying the cluster due to some error upstream
@@ -171,8 +250,9 @@ def main():
             print("\n".join([" ".join(c) for c in sacctmgr_commands]))
         else:
             logging.info("Executing %d commands", len(sacctmgr_commands))
-            execute_commands(scancel_commands, allow_failure=True)
-            execute_commands(sacctmgr_commands)
+            # cancelling jobs and removing associations is done per user, independent of the other users
+            execute_commands(scancel_commands, allow_failure=True, max_workers=MAX_PARALLEL_COMMANDS)
+            execute_commands(sacctmgr_commands, max_workers=MAX_PARALLEL_COMMANDS)
 
         if not opts.options.dry_run:
             (_, ldap_timestamp) = convert_timestamp(start_time)
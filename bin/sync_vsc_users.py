@@ -31,12 +31,15 @@ The script should result in an idempotent execution, to ensure nothing breaks.
 import logging
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
+
 from vsc.accountpage.client import AccountpageClient
 from vsc.accountpage.wrappers import mkVscUserSizeQuota
+from vsc.administration.base import make_storage
+from vsc.administration.tools import retry_request
 from vsc.administration.user import process_users, process_users_quota
 from vsc.administration.vo import process_vos
 from vsc.config.base import GENT
-from vsc.utils.missing import nub
 from vsc.utils.nagios import NAGIOS_EXIT_CRITICAL
 from vsc.utils.script_tools import ExtendedSimpleOption
 from vsc.utils.timestamp import convert_timestamp, write_timestamp, retrieve_timestamp_with_default
@@ -59,6 +62,72 @@ class UserGroupStatusUpdateError(Exception):
     pass
 
 
+def make_client(options):
+    """Create a client for the account page REST API."""
+    return AccountpageClient(token=options.access_token, url=options.account_page_url + "/api/")
+
+
+def sync_users(storage_name, options, accounts, last_timestamp):
+    """Deploy the given accounts on the given storage and set the quota that changed on it.
+
+    @param accounts: dict with the account page records of the accounts to deploy by vsc_id
+    @returns: tuple with the (ok, fail) results of the users and of the quota
+    """
+    client = make_client(options)
+    storage = make_storage(options.host_institute)
+
+    users_result = process_users(
+        options,
+        list(accounts),
+        storage_name,
+        client,
+        options.host_institute,
+        storage=storage,
+        accounts=accounts)
+
+    # only wrap the quota of user filesets, the others are dropped right away
+    storage_changed_quota = [mkVscUserSizeQuota(q) for q in
+                             retry_request(client.quota.user.storage[storage_name].modified[last_timestamp].get)[1]
+                             if q['fileset'].startswith('vsc')]
+    logging.info("Found %d accounts that have changed quota on storage %s in the accountpage since %s",
+                len(storage_changed_quota), storage_name, last_timestamp)
+
+    quota_result = process_users_quota(
+        options,
+        storage_changed_quota,
+        storage_name,
+        client,
+        options.host_institute,
+        storage=storage)
+
+    return (users_result, quota_result)
+
+
+def sync_vos(storage_name, options, vos, last_timestamp):
+    """Deploy the given VOs on the given storage."""
+    return process_vos(
+        options,
+        vos,
+        storage_name,
+        make_client(options),
+        last_timestamp,
+        options.host_institute,
+        storage=make_storage(options.host_institute))
+
+
+def run_per_storage(function, storages, *args):
+    """Run function(storage_name, *args) concurrently for each of the given storages.
+
+    Every call gets its own account page client and its own copy of the storage configuration, so the
+    storage backends (and their dry_run setting) are never shared between threads.
+
+    @returns: list of (storage_name, result) tuples, in the order of the given storages
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(storages))) as executor:
+        futures = [executor.submit(function, storage_name, *args) for storage_name in storages]
+        return [(storage_name, future.result()) for (storage_name, future) in zip(storages, futures)]
+
+
 def main():
     """
     Main script.
@@ -90,77 +159,60 @@ def main():
     logging.info("Using startime %s", start_time)
 
     try:
-        client = AccountpageClient(token=opts.options.access_token, url=opts.options.account_page_url + "/api/")
+        client = make_client(opts.options)
 
         institute = opts.options.host_institute
 
-        (users_ok, users_fail) = ([], [])
-        (quota_ok, quota_fail) = ([], [])
+        # failures on any of the storages, these prevent the timestamp from being updated
+        failures = []
+
         if opts.options.user:
-            changed_accounts = client.account.institute[institute].modified[last_timestamp].get()[1]
+            changed_accounts = retry_request(client.account.institute[institute].modified[last_timestamp].get)[1]
 
             logging.info("Found %d %s accounts that have changed in the accountpage since %s",
                         len(changed_accounts), institute, last_timestamp)
 
-            accounts = nub([u['vsc_id'] for u in changed_accounts])
+            # deduplicate while keeping the order, in a single pass, and keep the records, so the
+            # accounts need not be fetched again one by one
+            accounts = {u['vsc_id']: u for u in changed_accounts}
 
-            for storage_name in opts.options.storage:
-                (users_ok, users_fail) = process_users(
-                    opts.options,
-                    accounts,
-                    storage_name,
-                    client,
-                    institute)
+            for (storage_name, ((users_ok, users_fail), (quota_ok, quota_fail))) in run_per_storage(
+                    sync_users, opts.options.storage, opts.options, accounts, last_timestamp):
                 stats[f"{storage_name}_users_sync"] = len(users_ok)
                 stats[f"{storage_name}_users_sync_fail"] = len(users_fail)
                 stats[f"{storage_name}_users_sync_fail_warning"] = STORAGE_USERS_LIMIT_WARNING
                 stats[f"{storage_name}_users_sync_fail_critical"] = STORAGE_USERS_LIMIT_CRITICAL
-
-            for storage_name in opts.options.storage:
-                storage_changed_quota = [mkVscUserSizeQuota(q) for q in
-                                         client.quota.user.storage[storage_name].modified[last_timestamp].get()[1]]
-                storage_changed_quota = [q for q in storage_changed_quota if q.fileset.startswith('vsc')]
-                logging.info("Found %d accounts that have changed quota on storage %s in the accountpage since %s",
-                            len(storage_changed_quota), storage_name, last_timestamp)
-                (quota_ok, quota_fail) = process_users_quota(
-                    opts.options,
-                    storage_changed_quota,
-                    storage_name,
-                    client,
-                    institute)
                 stats[f"{storage_name}_quota_sync"] = len(quota_ok)
                 stats[f"{storage_name}_quota_sync_fail"] = len(quota_fail)
                 stats[f"{storage_name}_quota_sync_fail_warning"] = STORAGE_QUOTA_LIMIT_WARNING
                 stats[f"{storage_name}_quota_sync_fail_critical"] = STORAGE_QUOTA_LIMIT_CRITICAL
+                failures.extend(users_fail)
+                failures.extend(quota_fail)
 
-        (vos_ok, vos_fail) = ([], [])
         if opts.options.vo:
-            changed_vos = client.vo.institute[institute].modified[last_timestamp].get()[1]
-            changed_vo_quota = client.quota.vo.modified[last_timestamp].get()[1]
+            changed_vos = retry_request(client.vo.institute[institute].modified[last_timestamp].get)[1]
+            changed_vo_quota = retry_request(client.quota.vo.modified[last_timestamp].get)[1]
 
-            vos = sorted(set([v['vsc_id'] for v in changed_vos] +
-                             [v['virtual_organisation'] for v in changed_vo_quota]))
+            # collect the VO ids directly into a set, no intermediate lists needed
+            vos = {v['vsc_id'] for v in changed_vos}
+            vos.update(v['virtual_organisation'] for v in changed_vo_quota)
+            vos = sorted(vos)
 
             logging.info("Found %d %s VOs that have changed in the accountpage since %s",
                         len(changed_vos), institute, last_timestamp)
             logging.info("Found %d %s VOs that have changed quota in the accountpage since %s",
                         len(changed_vo_quota), institute, last_timestamp)
-            logging.debug(f"Found the following {institute} VOs: {vos}")
-
-            for storage_name in opts.options.storage:
-                (vos_ok, vos_fail) = process_vos(
-                    opts.options,
-                    vos,
-                    storage_name,
-                    client,
-                    last_timestamp,
-                    institute)
+            logging.debug("Found the following %s VOs: %s", institute, vos)
+
+            for (storage_name, (vos_ok, vos_fail)) in run_per_storage(
+                    sync_vos, opts.options.storage, opts.options, vos, last_timestamp):
                 stats[f"{storage_name}_vos_sync"] = len(vos_ok)
                 stats[f"{storage_name}_vos_sync_fail"] = len(vos_fail)
                 stats[f"{storage_name}_vos_sync_fail_warning"] = STORAGE_VO_LIMIT_WARNING
                 stats[f"{storage_name}_vos_sync_fail_critical"] = STORAGE_VO_LIMIT_CRITICAL
+                failures.extend(vos_fail)
 
-        if not (users_fail or quota_fail or vos_fail) and not opts.options.dry_run:
+        if not failures and not opts.options.dry_run:
             (_, ldap_timestamp) = convert_timestamp(start_time)
             write_timestamp(SYNC_TIMESTAMP_FILENAME, ldap_timestamp)
     except Exception as err:
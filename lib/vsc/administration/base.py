@@ -21,8 +21,10 @@ This file contains common utilities for dealing with both users and VOs.
 @author: Alex Domingo (Vrije Universiteit Brussel)
 """
 
+import copy
 import logging
 import os
+import weakref
 
 from vsc.config.base import VscStorage, GENT, VSC_DATA, VSC_DATA_SHARED, VSC_HOME
 from vsc.filesystem.operator import StorageOperator
@@ -30,6 +32,30 @@ from vsc.filesystem.operator import StorageOperator
 MOUNT_POINT_LOGIN = 'login'
 MOUNT_POINT_DEFAULT = 'backend'
 
+# storage operators that are known to support listing filesets, shared operators only need to be probed once
+_listing_operators = weakref.WeakSet()
+
+
+def make_storage(host_institute=GENT):
+    """
+    Return a private copy of the storage configuration, e.g., to use in a separate thread
+
+    VscStorage() always hands out the same instance, to which VscTier2Accountpage attaches its storage operators.
+    The operators of the host institute are left out of the copy, new ones are set up when the copy is first used.
+    """
+    storage = VscStorage()
+    institute_storage = storage[host_institute]
+
+    # deepcopy takes whatever is in the memo as the copy, so the operators (and their backends) become None
+    memo = {}
+    for fs in institute_storage:
+        operator = getattr(institute_storage[fs], 'operator', None)
+        if operator is not None:
+            memo[id(operator)] = None
+
+    return copy.deepcopy(storage, memo)
+
+
 class VscTier2Accountpage():
     """Common methods to handle settings from the account page"""
 
@@ -45,8 +71,10 @@ class VscTier2Accountpage():
         self.institute_storage = self.storage[self.host_institute]
 
         # Initialze the corresponding operator for each storage backend
+        # operators already present in a given storage are kept, so they (and their caches) can be shared
         for fs in self.storage[self.host_institute]:
-            self.storage[self.host_institute][fs].operator = StorageOperator(self.storage[self.host_institute][fs])
+            if storage is None or getattr(self.storage[self.host_institute][fs], 'operator', None) is None:
+                self.storage[self.host_institute][fs].operator = StorageOperator(self.storage[self.host_institute][fs])
 
     def _create_fileset(self, storage, path, fileset_name, parent_fileset=None, mod='755'):
         """Create a fileset in the storage backend"""
@@ -58,24 +86,31 @@ class VscTier2Accountpage():
             logging.exception(errmsg, fileset_name)
             raise
 
-        try:
-            storage.operator().list_filesets()
-        except AttributeError:
-            logging.exception("Storage backend %s does not support listing filesets", storage.backend)
-            raise
+        operator = storage.operator()
+        if operator not in _listing_operators:
+            try:
+                operator.list_filesets()
+            except AttributeError:
+                logging.exception("Storage backend %s does not support listing filesets", storage.backend)
+                raise
+            _listing_operators.add(operator)
 
         logging.info("Trying to create fileset %s with link path %s", fileset_name, path)
 
-        if not storage.operator().get_fileset_info(filesystem_name, fileset_name):
+        if not operator.get_fileset_info(filesystem_name, fileset_name):
             logging.info("Creating new fileset on %s with name %s and path %s", filesystem_name, fileset_name, path)
             base_dir_hierarchy = os.path.dirname(path)
-            storage.operator().make_dir(base_dir_hierarchy)
-            storage.operator().make_fileset(path, fileset_name, parent_fileset_name=parent_fileset)
+            operator.make_dir(base_dir_hierarchy)
+            operator.make_fileset(path, fileset_name, parent_fileset_name=parent_fileset)
+            # the operator may be shared, make sure the new fileset shows up for the next lookup.
+            # In a dry run, nothing was made, so there is nothing new to list either.
+            if not operator.dry_run:
+                operator.list_filesets(update=True)
         else:
             logging.info("Fileset %s already exists ... not creating again.", fileset_name)
 
         mod_oct = int(mod, 8)
-        storage.operator().chmod(mod_oct, path)
+        operator.chmod(mod_oct, path)
 
     def _get_storage(self, storage_name):
         """Seek and return storage settings from institute's storage"""
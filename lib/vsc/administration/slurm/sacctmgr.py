@@ -17,8 +17,8 @@ sacctmgr commands
 """
 import logging
 from enum import Enum
+from operator import itemgetter
 
-from vsc.accountpage.wrappers import mkNamedTupleInstance
 from vsc.config.base import ANTWERPEN, BRUSSEL, GENT, LEUVEN
 from vsc.utils.missing import namedtuple_with_defaults
 from vsc.utils.run import asyncloop
@@ -84,96 +84,134 @@ SlurmQos = namedtuple_with_defaults('SlurmQos', SacctQosFields)
 SlurmResource = namedtuple_with_defaults('SlurmResource', SacctResourceFields)
 
 
-def mkSlurmAccount(fields):
-    """Make a named tuple from the given fields."""
-    account = mkNamedTupleInstance(fields, SlurmAccount)
-    if account.Account in IGNORE_ACCOUNTS:
+def mksacctmgr(mode):
+    """Decorator to prefix common sacctmgr code for mode"""
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            prefix = [SLURM_SACCT_MGR, "-i", mode]
+            return prefix + function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def positional_factory(header, named_tuple):
+    """Return a function that makes a named_tuple instance from the split fields of a line with the given header.
+
+    The position of each field is looked up once, rather than zipping every line with the header into a dict.
+    Fields that are not in the header get their default value, as do the fields missing at the end of a short line.
+    """
+    positions = [header.index(f) if f in header else None for f in named_tuple._fields]
+    width = len(header)
+
+    if None in positions:
+        def make(fields):
+            if len(fields) < width:
+                fields = fields + [None] * (width - len(fields))
+            return named_tuple._make(None if p is None else fields[p] for p in positions)
+    else:
+        getter = itemgetter(*positions)
+
+        def make(fields):
+            if len(fields) < width:
+                fields = fields + [None] * (width - len(fields))
+            return named_tuple._make(getter(fields))
+
+    return make
+
+
+def check_slurm_account(account, exclude):
+    """Return the account, or None if it should be skipped."""
+    # association information for a user. Users are processed later.
+    if account.User or account.Account in IGNORE_ACCOUNTS or account.Account in exclude:
         return None
     return account
 
 
-def mkSlurmUser(fields):
-    """Make a named tuple from the given fields."""
-    user = mkNamedTupleInstance(fields, SlurmUser)
+def check_slurm_user(user, exclude):
+    """Return the user, or None if it should be skipped."""
     if user.User in IGNORE_USERS:
         return None
     return user
 
 
-def mkSlurmQos(fields):
-    """Make a named tuple from the given fields"""
-    qos = mkNamedTupleInstance(fields, SlurmQos)
-    return qos
+def check_slurm_resource(resource, exclude):
+    """Return the resource with its count as an int."""
+    return resource._replace(Count=int(resource.Count))
 
 
-def mkSlurmResource(fields):
-    """Make a named tuple from the given fields"""
-    fields['Count'] = int(fields['Count'])
-    resource = mkNamedTupleInstance(fields, SlurmResource)
-    return resource
+# the named tuple for each type of listing and the check (if any) that is applied to every tuple made
+SACCT_CREATORS = {
+    SacctMgrTypes.accounts: (SlurmAccount, check_slurm_account),
+    SacctMgrTypes.users: (SlurmUser, check_slurm_user),
+    SacctMgrTypes.qos: (SlurmQos, None),
+    SacctMgrTypes.resource: (SlurmResource, check_slurm_resource),
+}
 
 
-def mksacctmgr(mode):
-    """Decorator to prefix common sacctmgr code for mode"""
-    def decorator(function):
-        def wrapper(*args, **kwargs):
-            prefix = [SLURM_SACCT_MGR, "-i", mode]
-            return prefix + function(*args, **kwargs)
-        return wrapper
-    return decorator
+def sacct_creator(header, info_type, exclude=None):
+    """Return a function that makes the named tuple for the split fields of a line with the given header.
 
+    The function returns None for the lines that should be skipped, i.e., ignored users and accounts and, for the
+    accounts, the associations of users with an account.
 
-def parse_slurm_sacct_line(header, line, info_type, user_field_number, account_field_number, exclude=None):
-    """Parse the line into the correct data type."""
-    fields = line.split("|")
-
-    if info_type == SacctMgrTypes.accounts:
-        if exclude and fields[account_field_number] in exclude:
-            return None
-        if fields[user_field_number]:
-            # association information for a user. Users are processed later.
-            return None
-        creator = mkSlurmAccount
-    elif info_type == SacctMgrTypes.users:
-        creator = mkSlurmUser
-    elif info_type == SacctMgrTypes.qos:
-        creator = mkSlurmQos
-    elif info_type == SacctMgrTypes.resource:
-        creator = mkSlurmResource
-    else:
+    @returns: the function, or None if the info_type is unknown
+    """
+    if info_type not in SACCT_CREATORS:
         return None
 
-    return creator(dict(zip(header, fields)))
+    (named_tuple, check) = SACCT_CREATORS[info_type]
+    make = positional_factory(header, named_tuple)
+    if check is None:
+        return make
+
+    exclude = frozenset(exclude or [])
+    return lambda fields: check(make(fields), exclude)
+
+
+def parse_slurm_sacct_line(header, line, info_type, user_field_number=None, account_field_number=None, exclude=None):
+    """Parse the line into the correct data type.
+
+    Kept for backwards compatibility, parse_slurm_sacct_dump sets up the parsing once per dump instead.
+    The user and account field numbers are no longer needed, the fields are found by name in the header.
+    """
+    creator = sacct_creator(header, info_type, exclude=exclude)
+    if creator is None:
+        return None
+
+    return creator(line.rstrip().split("|"))
 
 
 def parse_slurm_sacct_dump(lines, info_type, exclude=None):
-    """Parse the sacctmgr dump from the listing."""
+    """Parse the sacctmgr dump from the listing.
+
+    @param lines: iterable of lines, the first one being the header
+    """
     acct_info = set()
+    add = acct_info.add
 
-    header = [w.replace(' ', '_').replace('%', 'PCT_') for w in lines[0].rstrip().split("|")]
-    header_names = [h.lower() for h in header]
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return acct_info
 
-    if info_type == SacctMgrTypes.accounts:
-        user_field_number = header_names.index("user")
-        account_field_number = header_names.index("account")
-    else:
-        user_field_number = None
-        account_field_number = None
+    header = [w.replace(' ', '_').replace('%', 'PCT_') for w in first.rstrip().split("|")]
+
+    creator = sacct_creator(header, info_type, exclude=exclude)
+    if creator is None:
+        raise SacctMgrException(f"Cannot parse sacctmgr listing of unknown type {info_type}")
 
-    for line in lines[1:]:
+    for line in lines:
         logging.debug("line %s", line)
         line = line.rstrip()
         try:
-            info = parse_slurm_sacct_line(
-                header, line, info_type, user_field_number, account_field_number, exclude=exclude
-            )
+            info = creator(line.split("|"))
         except Exception as err:
             logging.exception("Slurm sacct parse dump: could not process line %s [%s]", line, err)
             raise
         # This fails when we get e.g., the users and look at the account lines.
         # We should them just skip that line instead of raising an exception
         if info:
-            acct_info.add(info)
+            add(info)
 
     return acct_info
 
@@ -99,6 +99,14 @@ def mkSlurmPartition(fields):
     return lic
 
 
+SCONTROL_CREATORS = {
+    ScontrolTypes.license: mkSlurmLicense,
+    ScontrolTypes.reservation: mkSlurmReservation,
+    ScontrolTypes.config: mkSlurmConfig,
+    ScontrolTypes.partition: mkSlurmPartition,
+}
+
+
 def mkscontrol(mode):
     """Decorator to prefix common sacctmgr code for mode"""
     def decorator(function):
@@ -111,6 +119,10 @@ def mkscontrol(mode):
 
 def parse_scontrol_line(line, info_type):
     """Parse the line into the correct data type."""
+    creator = SCONTROL_CREATORS.get(info_type)
+    if creator is None:
+        return None
+
     # output should have eg 'Flags=' or 'Account=(null)'
     fields = dict([x.split("=", 1) for x in shlex.split(line)])
 
@@ -121,17 +133,6 @@ def parse_scontrol_line(line, info_type):
 
     # sanity check for keys vs the fields?
 
-    if info_type == ScontrolTypes.license:
-        creator = mkSlurmLicense
-    elif info_type == ScontrolTypes.reservation:
-        creator = mkSlurmReservation
-    elif info_type == ScontrolTypes.config:
-        creator = mkSlurmConfig
-    elif info_type == ScontrolTypes.partition:
-        creator = mkSlurmPartition
-    else:
-        return None
-
     return creator(fields)
 
 
@@ -16,8 +16,10 @@
 Functions to deploy users to slurm.
 """
 import logging
+import threading
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from vsc.config.base import GENT, INSTITUTE_VOS_BY_INSTITUTE, INSTITUTE_FAIRSHARE
 from vsc.utils.run import RunNoShell
@@ -40,20 +42,58 @@ class SCommandException(Exception):
     pass
 
 
-def execute_commands(commands, allow_failure=False):
-    """Run the specified commands"""
+# number of commands that are run at the same time when they do not depend on each other
+MAX_PARALLEL_COMMANDS = 8
 
-    for command in commands:
-        logging.info("Running command: %s", command)
 
-        # if one fails, we simply fail the script and should get notified
-        (ec, output) = RunNoShell.run(command)
-        if ec != 0 and not allow_failure:
-            # Check if "Nothing added" is in the output, if so, we can ignore the error
-            if output and "Nothing added" in output:
-                logging.info("Command %s failed, but nothing was added", command)
-            else:
-                raise SCommandException(f"Command failed: {command}")
+def execute_command(command, allow_failure=False):
+    """Run the specified command"""
+    logging.info("Running command: %s", command)
+
+    # if one fails, we simply fail the script and should get notified
+    (ec, output) = RunNoShell.run(command)
+    if ec != 0 and not allow_failure:
+        # Check if "Nothing added" is in the output, if so, we can ignore the error
+        if output and "Nothing added" in output:
+            logging.info("Command %s failed, but nothing was added", command)
+        else:
+            raise SCommandException(f"Command failed: {command}")
+
+
+def execute_commands(commands, allow_failure=False, max_workers=1):
+    """Run the specified commands
+
+    With max_workers > 1, up to that many commands run at the same time, so the order in which they
+    are executed is no longer guaranteed. Only use this for commands that do not depend on each other.
+    """
+    if max_workers <= 1 or len(commands) <= 1:
+        for command in commands:
+            execute_command(command, allow_failure)
+        return
+
+    failed = threading.Event()
+
+    def run(command):
+        # commands that were already queued are not started anymore once one of them failed
+        if failed.is_set():
+            logging.info("Not running command %s after an earlier failure", command)
+            return
+        try:
+            execute_command(command, allow_failure)
+        except SCommandException:
+            failed.set()
+            raise
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run, command) for command in commands]
+        try:
+            for future in futures:
+                future.result()
+        except SCommandException:
+            # do not start any of the remaining commands
+            for future in futures:
+                future.cancel()
+            raise
 
 
 TIER1_GPU_TO_CPU_HOURS_RATE = 12 # 12 cpus per gpu
@@ -277,12 +317,12 @@ def slurm_project_users_accounts(
             logging.debug("%d new users", len(new_users))
             logging.debug("%d removed project users", len(remove_project_users))
             logging.debug("===============================================================")
-            logging.debug(f"Project {project_name} members: {members}")
-            logging.debug(f"Project {project_name} project_partitions: {project_partitions}")
-            logging.debug(f"Project {project_name} slurm_project_users: {slurm_project_users}")
-            logging.debug(f"Project {project_name} obsolete_slurm_project_users: {obsolete_slurm_project_users}")
-            logging.debug(f"Project {project_name} new_users: {new_users}")
-            logging.debug(f"Project {project_name} removed users: {remove_project_users}")
+            logging.debug("Project %s members: %s", project_name, members)
+            logging.debug("Project %s project_partitions: %s", project_name, project_partitions)
+            logging.debug("Project %s slurm_project_users: %s", project_name, slurm_project_users)
+            logging.debug("Project %s obsolete_slurm_project_users: %s", project_name, obsolete_slurm_project_users)
+            logging.debug("Project %s new_users: %s", project_name, new_users)
+            logging.debug("Project %s removed users: %s", project_name, remove_project_users)
             logging.debug("===============================================================")
 
         cluster_users_with_default_account = {u for (u, a, _) in cluster_users_acct if a == default_account}
@@ -19,11 +19,28 @@ Original Perl code by Stijn De Weirdt
 @author: Andy Georges (Ghent University)
 """
 import logging
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
 
 TIER1_GRACE_GROUP_SUFFIX = "t1_mukgraceusers"
 TIER1_HELPDESK_ADDRESS = "tier1@ugent.be"
 UGENT_SMTP_ADDRESS = "smtp.ugent.be"
 
+# maximal number of concurrent requests to the account page
+MAX_PARALLEL_REQUESTS = 16
+
+# shared by all prefetch calls, so concurrent prefetches (e.g., one per storage) stay within the limit together
+_request_slots = threading.BoundedSemaphore(MAX_PARALLEL_REQUESTS)
+
+# HTTP status codes of failed requests that are worth retrying
+RETRY_HTTP_CODES = (429, 502, 503, 504)
+RETRY_ATTEMPTS = 8
+RETRY_MAX_WAIT = 60  # seconds
+
 REINSTATEMENT_MESSAGE = """
 Dear %(gecos)s,
 
@@ -67,3 +84,54 @@ def quota_limits(quota, soft_fraction, replication_factor=1):
     soft = int(hard * soft_fraction)
 
     return hard, soft
+
+
+def prefetch(function, items, max_workers=MAX_PARALLEL_REQUESTS):
+    """
+    Call function for each of the items concurrently, ignoring its result
+
+    This is meant to warm up the caches of objects that lazily fetch their data, e.g., from the account page.
+    Failures are only logged, the caller runs into them again when using the data and deals with them there.
+    At most MAX_PARALLEL_REQUESTS calls run at the same time, over all prefetch calls in the process.
+    """
+    def call(item):
+        try:
+            with _request_slots:
+                function(item)
+        except Exception as err:
+            logging.debug("Prefetching data for %s failed: %s", item, err)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(call, items))
+
+
+def retry_request(function, *args, **kwargs):
+    """
+    Call function (typically a REST client request) with the given arguments and return its result
+
+    Transient failures, i.e., connection problems and HTTP errors with a code in RETRY_HTTP_CODES, are retried
+    up to RETRY_ATTEMPTS times, with an exponential backoff and full jitter in between. If the server sends a
+    Retry-After header (in seconds), that is waited for instead.
+    """
+    for attempt in range(1, RETRY_ATTEMPTS + 1):
+        try:
+            return function(*args, **kwargs)
+        except HTTPError as err:
+            if err.code not in RETRY_HTTP_CODES or attempt == RETRY_ATTEMPTS:
+                raise
+            reason = f"HTTP error {err.code}"
+            retry_after = err.headers.get('Retry-After') if err.headers else None
+        except (URLError, ConnectionError) as err:
+            if attempt == RETRY_ATTEMPTS:
+                raise
+            reason = str(err)
+            retry_after = None
+
+        try:
+            wait = min(int(retry_after), RETRY_MAX_WAIT)
+        except (TypeError, ValueError):
+            wait = random.uniform(0, min(2 ** attempt, RETRY_MAX_WAIT))
+
+        logging.warning("Request failed (%s), attempt %d of %d, retrying in %.1f seconds",
+                        reason, attempt, RETRY_ATTEMPTS, wait)
+        time.sleep(wait)
@@ -24,13 +24,13 @@ This file contains the utilities for dealing with users on the VSC.
 import logging
 import os
 
-from urllib.request import HTTPError
+from urllib.error import HTTPError
 
 from vsc.accountpage.wrappers import mkVscAccountPubkey, mkVscHomeOnScratch
 from vsc.accountpage.wrappers import mkVscAccount, mkUserGroup
 from vsc.accountpage.wrappers import mkGroup, mkVscUserSizeQuota
 from vsc.administration.base import VscTier2Accountpage, MOUNT_POINT_DEFAULT
-from vsc.administration.tools import quota_limits
+from vsc.administration.tools import prefetch, quota_limits, retry_request
 from vsc.config.base import (
     VSC, VSC_DATA, VSC_HOME, VSC_PRODUCTION_SCRATCH, BRUSSEL, GENT,
     VO_PREFIX_BY_INSTITUTE, VSC_SCRATCH_KYUKON, VSC_SCRATCH_RHEA,
@@ -65,14 +65,13 @@ class VscAccountPageUser:
         self.user_id = user_id
         self.rest_client = rest_client
 
+        self._cache = {}
+        self._init_cache(pubkeys=pubkeys, account=account)
+
         # init global cache
+        # the cache is filled in before it is shared, so concurrent instances never see a partial cache
         if use_user_cache:
-            self._cache = _users_cache[self.__class__.__name__].setdefault(user_id, {})
-        else:
-            self._cache = {}
-
-        if not self._cache:
-            self._init_cache(pubkeys=pubkeys, account=account)
+            self._cache = _users_cache[self.__class__.__name__].setdefault(user_id, self._cache)
 
     def _init_cache(self, **kwargs):
         self._cache['pubkeys'] = kwargs.get('pubkeys', None)
@@ -83,7 +82,7 @@ class VscAccountPageUser:
     @property
     def account(self):
         if not self._cache['account']:
-            self._cache['account'] = mkVscAccount((self.rest_client.account[self.user_id].get())[1])
+            self._cache['account'] = mkVscAccount(retry_request(self.rest_client.account[self.user_id].get)[1])
         return self._cache['account']
 
     @property
@@ -95,23 +94,24 @@ class VscAccountPageUser:
         if not self._cache['usergroup']:
             if self.person.institute_login in ('x_admin', 'admin', 'voadmin'):
                 # TODO to be removed when magic site admin usergroups are purged from code
-                self._cache['usergroup'] = mkGroup((self.rest_client.group[self.user_id].get())[1])
+                self._cache['usergroup'] = mkGroup(retry_request(self.rest_client.group[self.user_id].get)[1])
             else:
-                self._cache['usergroup'] = mkUserGroup(self.rest_client.account[self.user_id].usergroup.get()[1])
+                usergroup = retry_request(self.rest_client.account[self.user_id].usergroup.get)[1]
+                self._cache['usergroup'] = mkUserGroup(usergroup)
 
         return self._cache['usergroup']
 
     @property
     def home_on_scratch(self):
         if self._cache['home_on_scratch'] is None:
-            hos = self.rest_client.account[self.user_id].home_on_scratch.get()[1]
+            hos = retry_request(self.rest_client.account[self.user_id].home_on_scratch.get)[1]
             self._cache['home_on_scratch'] = [mkVscHomeOnScratch(h) for h in hos]
         return self._cache['home_on_scratch']
 
     @property
     def pubkeys(self):
         if self._cache['pubkeys'] is None:  # an empty list is allowed :)
-            ps = self.rest_client.account[self.user_id].pubkey.get()[1]
+            ps = retry_request(self.rest_client.account[self.user_id].pubkey.get)[1]
             self._cache['pubkeys'] = [mkVscAccountPubkey(p) for p in ps if not p['deleted']]
         return self._cache['pubkeys']
 
@@ -188,37 +188,57 @@ class VscTier2AccountpageUser(VscAccountPageUser, VscTier2Accountpage):
         return self._cache['quota']['vo']['scratch']
 
     def _init_quota_cache(self):
-        all_quota = [mkVscUserSizeQuota(q) for q in self.rest_client.account[self.user_id].quota.get()[1]]
+        all_quota = retry_request(self.rest_client.account[self.user_id].quota.get)[1]
         # we no longer set defaults, since we do not want to accidentally revert people to some default
         # that is lower than their actual quota if the accountpage goes down in between retrieving the users
         # and fetching the quota
-        institute_quota = [q for q in all_quota if q.storage['institute'] == self.host_institute]
         fileset_name = self.vsc.user_grouping_fileset(self.account.vsc_id)
-
-        def user_proposition(quota, storage_type):
-            return quota.fileset == fileset_name and quota.storage['storage_type'] == storage_type
+        vo_prefix = VO_PREFIX_BY_INSTITUTE[self.host_institute]
+
+        home_quota = None
+        data_quota = None
+        scratch_quota = []
+        vo_quota = {DATA_KEY: [], SCRATCH_KEY: []}
+
+        # sort the quota on the storage of the host institute in a single pass, the first one wins for home and data
+        for quota in all_quota:
+            if quota['storage']['institute'] != self.host_institute:
+                continue
+
+            quota = mkVscUserSizeQuota(quota)
+            storage_type = quota.storage['storage_type']
+
+            if quota.fileset == fileset_name:
+                if storage_type == HOME_KEY and home_quota is None:
+                    home_quota = quota.hard
+                elif (storage_type == DATA_KEY and data_quota is None and
+                      not quota.storage['name'].endswith(STORAGE_SHARED_SUFFIX)):
+                    data_quota = quota.hard
+                elif storage_type == SCRATCH_KEY:
+                    scratch_quota.append(quota)
+
+            if quota.fileset.startswith(vo_prefix) and storage_type in vo_quota:
+                vo_quota[storage_type].append(quota)
+
+        quota_cache = {
+            'vo': {
+                'data': vo_quota[DATA_KEY],
+                'scratch': vo_quota[SCRATCH_KEY],
+            },
+        }
 
         # Non-UGent users who have quota in Gent, e.g., in a VO, should not have these set
         if self.person.institute['name'] == self.host_institute:
-            # next(iter(a_list), None) will return the first item of a_list if the list is non-empty, other None
-            self._cache['quota']['home'] = next(iter([q.hard for q in institute_quota
-                                                      if user_proposition(q, HOME_KEY)]), None)
-            self._cache['quota']['data'] = next(iter([q.hard for q in institute_quota
-                                            if user_proposition(q, DATA_KEY) and not
-                                            q.storage['name'].endswith(STORAGE_SHARED_SUFFIX)]), None)
-            self._cache['quota']['scratch'] = [q for q in institute_quota if user_proposition(q, SCRATCH_KEY)]
+            quota_cache['home'] = home_quota
+            quota_cache['data'] = data_quota
+            quota_cache['scratch'] = scratch_quota
         else:
-            self._cache['quota']['home'] = None
-            self._cache['quota']['data'] = None
-            self._cache['quota']['scratch'] = None
-
-        def user_vo_proposition(quota, storage_type):
-            return quota.fileset.startswith(VO_PREFIX_BY_INSTITUTE[self.host_institute]) and \
-                quota.storage['storage_type'] == storage_type
+            quota_cache['home'] = None
+            quota_cache['data'] = None
+            quota_cache['scratch'] = None
 
-        self._cache['quota']['vo'] = {}
-        self._cache['quota']['vo']['data'] = [q for q in institute_quota if user_vo_proposition(q, DATA_KEY)]
-        self._cache['quota']['vo']['scratch'] = [q for q in institute_quota if user_vo_proposition(q, SCRATCH_KEY)]
+        # only expose the quota once complete, the cache may be shared between threads
+        self._cache['quota'] = quota_cache
 
     def pickle_path(self):
         """Provide the location where to store pickle files for this user.
@@ -324,8 +344,8 @@ class VscTier2AccountpageUser(VscAccountPageUser, VscTier2Accountpage):
 
     def set_scratch_quota(self, storage_name):
         """Set USR quota on the scratch FS in the user fileset."""
-        quota = [q for q in self.user_scratch_quota if q.storage['name'] in (storage_name,)]
-        if not quota:
+        quota = next((q for q in self.user_scratch_quota if q.storage['name'] == storage_name), None)
+        if quota is None:
             logging.error("No scratch quota information available for %s", storage_name)
             return
 
@@ -336,7 +356,7 @@ class VscTier2AccountpageUser(VscAccountPageUser, VscTier2Accountpage):
             # that contains the path (the file, not the followed symlink)
             path = os.path.normpath(os.path.join(self._scratch_path(storage_name), '..'))
 
-        self._set_quota(storage_name, path, quota[0].hard)
+        self._set_quota(storage_name, path, quota.hard)
 
     def populate_home_dir(self):
         """Store the required files in the user's home directory.
@@ -391,10 +411,10 @@ def update_user_status(user, client):
 
     payload = {"status": ACTIVE}
     try:
-        response_account = client.account[user.user_id].patch(body=payload)
+        response_account = retry_request(client.account[user.user_id].patch, body=payload)
     except HTTPError as err:
         logging.error("Account %s and UserGroup %s status were not changed", user.user_id, user.user_id)
-        raise UserStatusUpdateError(f"Account %s status was not changed - received HTTP code {err.code}")
+        raise UserStatusUpdateError(f"Account {user.user_id} status was not changed - received HTTP code {err.code}")
     else:
         account = mkVscAccount(response_account[1])
         if account.status == ACTIVE:
@@ -404,20 +424,34 @@ def update_user_status(user, client):
             raise UserStatusUpdateError(f"Account {user.user_id} status was not changed, still at {account.status}")
 
 
-def process_users_quota(options, user_quota, storage_name, client, host_institute=GENT, use_user_cache=True):
+def process_users_quota(options, user_quota, storage_name, client, host_institute=GENT, use_user_cache=True,
+                        storage=None):
     """
     Process the users' quota for the given storage.
+
+    @param storage: VscStorage instance to use for the users, if None a fresh one is created and shared
     """
     error_quota = []
     ok_quota = []
 
+    users = []
     for quota in user_quota:
         user = VscTier2AccountpageUser(quota.user,
+                                       storage=storage,
                                        rest_client=client,
                                        host_institute=host_institute,
                                        use_user_cache=use_user_cache)
         user.dry_run = options.dry_run
+        # share the storage operators with the next users, so the backends only list their filesets once
+        storage = user.storage
+        users.append((quota, user))
+
+    # there is no bulk quota endpoint, so at least get the quota of all users concurrently
+    prefetch(lambda quota_user: quota_user[1].user_home_quota, users)
 
+    on_scratch = storage_name in VSC_PRODUCTION_SCRATCH[host_institute]
+
+    for (quota, user) in users:
         try:
             if storage_name == VSC_HOME:
                 user.set_home_quota()
@@ -425,7 +459,7 @@ def process_users_quota(options, user_quota, storage_name, client, host_institut
             if storage_name == VSC_DATA:
                 user.set_data_quota()
 
-            if storage_name in VSC_PRODUCTION_SCRATCH[host_institute]:
+            if on_scratch:
                 user.set_scratch_quota(storage_name)
 
             ok_quota.append(quota)
@@ -436,7 +470,8 @@ def process_users_quota(options, user_quota, storage_name, client, host_institut
     return (ok_quota, error_quota)
 
 
-def process_users(options, account_ids, storage_name, client, host_institute=GENT, use_user_cache=True):
+def process_users(options, account_ids, storage_name, client, host_institute=GENT, use_user_cache=True,
+                  storage=None, accounts=None):
     """
     Process the users.
 
@@ -450,16 +485,29 @@ def process_users(options, account_ids, storage_name, client, host_institute=GEN
             - create the grouping fileset if needed
             - create the user scratch directory
 
+    @param storage: VscStorage instance to use for the users, if None a fresh one is created and shared
+    @param accounts: dict with the account page records of (some of) the users by vsc_id, these are used
+                     instead of fetching each account separately
     """
     error_users = []
     ok_users = []
 
+    if accounts is None:
+        accounts = {}
+
+    on_scratch = storage_name in VSC_PRODUCTION_SCRATCH[host_institute]
+
     for vsc_id in sorted(account_ids):
+        account = accounts.get(vsc_id)
         user = VscTier2AccountpageUser(vsc_id,
+                                       storage=storage,
                                        rest_client=client,
+                                       account=mkVscAccount(account) if account else None,
                                        host_institute=host_institute,
                                        use_user_cache=use_user_cache)
         user.dry_run = options.dry_run
+        # share the storage operators with the next users, so the backends only list their filesets once
+        storage = user.storage
 
         try:
             if storage_name == VSC_HOME:
@@ -470,7 +518,7 @@ def process_users(options, account_ids, storage_name, client, host_institute=GEN
             if storage_name == VSC_DATA:
                 user.create_data_dir()
 
-            if storage_name in VSC_PRODUCTION_SCRATCH[host_institute]:
+            if on_scratch:
                 user.create_scratch_dir(storage_name)
 
             ok_users.append(user)
@@ -22,35 +22,36 @@ Original Perl code by Stijn De Weirdt
 @author: Alex Domingo (Vrije Universiteit Brussel)
 """
 
-import copy
+import functools
 import logging
 import os
 import pwd
 
-from urllib.request import HTTPError
+from collections import defaultdict
+from urllib.error import HTTPError
 
 from vsc.accountpage.wrappers import mkVo, mkVscVoSizeQuota, mkVscAccount, mkVscAutogroup
-from vsc.administration.user import VscTier2AccountpageUser, UserStatusUpdateError
+from vsc.administration.user import VscAccountPageUser, VscTier2AccountpageUser
 from vsc.administration.base import VscTier2Accountpage, MOUNT_POINT_DEFAULT
-from vsc.administration.tools import quota_limits
+from vsc.administration.tools import prefetch, quota_limits, retry_request
 from vsc.config.base import (
     VSC, VSC_HOME, VSC_DATA, VSC_DATA_SHARED, NEW, MODIFIED, MODIFY, ACTIVE, GENT, DATA_KEY, SCRATCH_KEY,
     DEFAULT_VOS_ALL, VSC_PRODUCTION_SCRATCH, INSTITUTE_VOS_BY_INSTITUTE, VO_SHARED_PREFIX_BY_INSTITUTE,
     VO_PREFIX_BY_INSTITUTE, STORAGE_SHARED_SUFFIX
 )
-from vsc.utils.missing import Monoid, MonoidDict
+
+
+DEFAULT_VOS = frozenset(DEFAULT_VOS_ALL)
 
 
 class VoStatusUpdateError(Exception):
     pass
 
 
-def whenHTTPErrorRaise(f, msg, **kwargs):
-    try:
-        return f(**kwargs)
-    except HTTPError as err:
-        logging.error("%s: %s", msg, err)
-        raise
+@functools.lru_cache(maxsize=1)
+def _nobody_uid():
+    """Look up the uid of nobody once, with NSS backed by LDAP every lookup is a network round trip"""
+    return pwd.getpwnam('nobody').pw_uid
 
 
 class VscAccountPageVo:
@@ -67,9 +68,12 @@ class VscAccountPageVo:
 
     @property
     def vo(self):
-        if not self._vo_cache:
-            self._vo_cache = mkVo(whenHTTPErrorRaise(self.rest_client.vo[self.vo_id].get,
-                                                     f"Could not get VO from accountpage for VO {self.vo_id}")[1])
+        if self._vo_cache is None:
+            try:
+                self._vo_cache = mkVo(retry_request(self.rest_client.vo[self.vo_id].get)[1])
+            except HTTPError as err:
+                logging.error("Could not get VO from accountpage for VO %s: %s", self.vo_id, err)
+                raise
         return self._vo_cache
 
 
@@ -86,7 +90,9 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
 
         self.vsc = VSC()
 
-        self.dry_run = False
+        # do not touch the storage operators here, they can be shared with other VOs and users already
+        # running with their own dry_run setting
+        super().__setattr__('dry_run', False)
 
         self._vo_data_quota_cache = None
         self._vo_data_shared_quota_cache = None
@@ -94,50 +100,64 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
         self._institute_quota_cache = None
 
         self._sharing_group_cache = None
+        self._shared_vsc_id_cache = None
+
+        self._path_cache = {}
 
     @property
     def _institute_quota(self):
-        if not self._institute_quota_cache:
-            all_quota = [mkVscVoSizeQuota(q) for q in
-                         whenHTTPErrorRaise(self.rest_client.vo[self.vo.vsc_id].quota.get,
-                                            f"Could not get quota from accountpage for VO {self.vo.vsc_id}")[1]]
-            self._institute_quota_cache = [q for q in all_quota if q.storage['institute'] == self.host_institute]
+        if self._institute_quota_cache is None:
+            try:
+                all_quota = retry_request(self.rest_client.vo[self.vo.vsc_id].quota.get)[1]
+            except HTTPError as err:
+                logging.error("Could not get quota from accountpage for VO %s: %s", self.vo.vsc_id, err)
+                raise
+            # only wrap the quota of our own institute
+            self._institute_quota_cache = [mkVscVoSizeQuota(q) for q in all_quota
+                                           if q['storage']['institute'] == self.host_institute]
         return self._institute_quota_cache
 
-    def _get_institute_data_quota(self):
-        return [q for q in self._institute_quota if q.storage['storage_type'] == DATA_KEY]
-
-    def _get_institute_non_shared_data_quota(self):
-        return [q.hard for q in self._get_institute_data_quota()
-                if not q.storage['name'].endswith(STORAGE_SHARED_SUFFIX)]
-
-    def _get_institute_shared_data_quota(self):
-        return [q.hard for q in self._get_institute_data_quota()
-                if q.storage['name'].endswith(STORAGE_SHARED_SUFFIX)]
+    def _split_institute_quota(self):
+        """Sort the institute quota in a single pass into the (non-shared) data, shared data and scratch quota"""
+        data_quota = []
+        data_shared_quota = []
+        scratch_quota = []
+
+        for q in self._institute_quota:
+            storage_type = q.storage['storage_type']
+            if storage_type == DATA_KEY:
+                if q.storage['name'].endswith(STORAGE_SHARED_SUFFIX):
+                    data_shared_quota.append(q.hard)
+                else:
+                    data_quota.append(q.hard)
+            elif storage_type == SCRATCH_KEY:
+                scratch_quota.append(q)
+
+        self._vo_data_quota_cache = data_quota
+        self._vo_data_shared_quota_cache = data_shared_quota
+        self._vo_scratch_quota_cache = scratch_quota
 
     @property
     def vo_data_quota(self):
+        if self._vo_data_quota_cache is None:
+            self._split_institute_quota()
         if not self._vo_data_quota_cache:
-            self._vo_data_quota_cache = self._get_institute_non_shared_data_quota()
-            if not self._vo_data_quota_cache:
-                self._vo_data_quota_cache = [self.storage[VSC_DATA].quota_vo]
+            self._vo_data_quota_cache = [self.storage[VSC_DATA].quota_vo]
 
         return self._vo_data_quota_cache[0]  # there can be only one
 
     @property
     def vo_data_shared_quota(self):
-        if not self._vo_data_shared_quota_cache:
-            try:
-                self._vo_data_shared_quota_cache = self._get_institute_shared_data_quota()[0]
-            except IndexError:
-                return None
-        return self._vo_data_shared_quota_cache
+        if self._vo_data_shared_quota_cache is None:
+            self._split_institute_quota()
+
+        # there can be only one, VOs without shared data have none at all
+        return self._vo_data_shared_quota_cache[0] if self._vo_data_shared_quota_cache else None
 
     @property
     def vo_scratch_quota(self):
-        if not self._vo_scratch_quota_cache:
-            self._vo_scratch_quota_cache = [q for q in self._institute_quota
-                                            if q.storage['storage_type'] == SCRATCH_KEY]
+        if self._vo_scratch_quota_cache is None:
+            self._split_institute_quota()
 
         return self._vo_scratch_quota_cache
 
@@ -146,15 +166,25 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
         if not self.data_sharing:
             return None
 
-        if not self._sharing_group_cache:
-            group_name = self.vo.vsc_id.replace(VO_PREFIX_BY_INSTITUTE[self.vo.institute['name']],
-                                                VO_SHARED_PREFIX_BY_INSTITUTE[self.vo.institute['name']])
-            self._sharing_group_cache = mkVscAutogroup(
-                whenHTTPErrorRaise(self.rest_client.autogroup[group_name].get,
-                                   f"Could not get autogroup {group_name} details")[1])
+        if self._sharing_group_cache is None:
+            group_name = self._shared_vsc_id
+            try:
+                self._sharing_group_cache = mkVscAutogroup(retry_request(self.rest_client.autogroup[group_name].get)[1])
+            except HTTPError as err:
+                logging.error("Could not get autogroup %s details: %s", group_name, err)
+                raise
 
         return self._sharing_group_cache
 
+    @property
+    def _shared_vsc_id(self):
+        """The name of the group and the fileset for sharing the VO data"""
+        if self._shared_vsc_id_cache is None:
+            institute = self.vo.institute['name']
+            self._shared_vsc_id_cache = self.vo.vsc_id.replace(VO_PREFIX_BY_INSTITUTE[institute],
+                                                               VO_SHARED_PREFIX_BY_INSTITUTE[institute])
+        return self._shared_vsc_id_cache
+
     @property
     def data_sharing(self):
         return self.vo_data_shared_quota is not None
@@ -166,8 +196,11 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
 
     def _get_path(self, storage_name, mount_point=MOUNT_POINT_DEFAULT):
         """Get the path for the (if any) user directory on the given storage."""
-        (path, _) = self.storage.path_templates[self.host_institute][storage_name]['vo'](self.vo.vsc_id)
-        return os.path.join(self._get_mount_path(storage_name, mount_point), path)
+        key = (storage_name, mount_point)
+        if key not in self._path_cache:
+            (path, _) = self.storage.path_templates[self.host_institute][storage_name]['vo'](self.vo.vsc_id)
+            self._path_cache[key] = os.path.join(self._get_mount_path(storage_name, mount_point), path)
+        return self._path_cache[key]
 
     def _create_vo_fileset(self, storage, path, parent_fileset=None, fileset_name=None, group_owner_id=None):
         """Create a fileset for the VO on the data filesystem.
@@ -190,15 +223,18 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
         self._create_fileset(storage, path, fileset_name, parent_fileset=parent_fileset, mod='770')
 
         try:
-            moderator = mkVscAccount(self.rest_client.account[self.vo.moderators[0]].get()[1])
+            # moderators typically have several VOs, so keep their account in the user cache
+            moderator = VscAccountPageUser(self.vo.moderators[0], self.rest_client, use_user_cache=True).account
         except HTTPError:
             logging.exception("Cannot obtain moderator information from account page, setting ownership to nobody")
-            storage.operator().chown(pwd.getpwnam('nobody').pw_uid, fileset_group_owner_id, path)
+            fileset_owner_id = _nobody_uid()
         except IndexError:
             logging.error("There is no moderator available for VO %s", self.vo.vsc_id)
-            storage.operator().chown(pwd.getpwnam('nobody').pw_uid, fileset_group_owner_id, path)
+            fileset_owner_id = _nobody_uid()
         else:
-            storage.operator().chown(moderator.vsc_id_number, fileset_group_owner_id, path)
+            fileset_owner_id = moderator.vsc_id_number
+
+        storage.operator().chown(fileset_owner_id, fileset_group_owner_id, path)
 
     def create_data_fileset(self):
         """Create the VO's directory on the HPC data filesystem. Always set the quota."""
@@ -244,10 +280,11 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
         # quota expressed in bytes, retrieved in KiB from the account backend
         hard, soft = quota_limits(quota * 1024, self.vsc.quota_soft_fraction, storage.data_replication_factor)
 
+        operator = storage.operator()
         try:
             # LDAP information is expressed in KiB, GPFS wants bytes.
-            storage.operator().set_fileset_quota(soft, path, fileset_name, hard)
-            storage.operator().set_fileset_grace(path, self.vsc.vo_storage_grace_time)  # 7 days
+            operator.set_fileset_quota(soft, path, fileset_name, hard)
+            operator.set_fileset_grace(path, self.vsc.vo_storage_grace_time)  # 7 days
         except storage.backend_operator_err:
             logging.exception("Unable to set quota on path %s", path)
             raise
@@ -266,15 +303,12 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
                 VSC_DATA_SHARED,
                 self._data_shared_path(),
                 int(self.vo_data_shared_quota),
-                fileset_name=self.vo.vsc_id.replace(
-                    VO_PREFIX_BY_INSTITUTE[self.vo.institute["name"]],
-                    VO_SHARED_PREFIX_BY_INSTITUTE[self.vo.institute["name"]],
-                ),
+                fileset_name=self._shared_vsc_id,
             )
 
     def set_scratch_quota(self, storage_name):
         """Set FILESET quota on the scratch FS for the VO fileset."""
-        quota = [q for q in self.vo_scratch_quota if q.storage['name'] in (storage_name,)]
+        quota = [q for q in self.vo_scratch_quota if q.storage['name'] == storage_name]
 
         if not quota:
             logging.error("No VO %s scratch quota information available for %s", self.vo.vsc_id, storage_name)
@@ -303,11 +337,12 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
 
         member_id = int(member.account.vsc_id_number)
 
+        operator = storage.operator()
         try:
-            storage.operator().set_user_quota(soft=soft, user=member_id, obj=path, hard=hard)
+            operator.set_user_quota(soft=soft, user=member_id, obj=path, hard=hard)
         except storage.backend_operator_err:
             err_msg = "Unable to set %s quota for member %s on path %s"
-            logging.exception(err_msg, storage.operator().quota_types.USR.value, member_id, path)
+            logging.exception(err_msg, operator.quota_types.USR.value, member_id, path)
             raise
 
     def set_member_data_quota(self, member):
@@ -323,7 +358,7 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
                             self.vo.vsc_id, member.account.vsc_id)
             return
 
-        if self.vo.vsc_id in DEFAULT_VOS_ALL:
+        if self.vo.vsc_id in DEFAULT_VOS:
             logging.warning("Not setting VO %s member %s data quota: No VO member quota for this VO",
                             member.account.vsc_id, self.vo.vsc_id)
             return
@@ -357,14 +392,14 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
                             self.vo.vsc_id, member.account.vsc_id)
             return
 
-        if self.vo.vsc_id in DEFAULT_VOS_ALL:
+        if self.vo.vsc_id in DEFAULT_VOS:
             logging.warning("Not setting VO %s member %s scratch quota: No VO member quota for this VO",
                             member.account.vsc_id, self.vo.vsc_id)
             return
 
         if member.vo_scratch_quota:
             quota = [q for q in member.vo_scratch_quota
-                     if q.storage['name'] in (storage_name,) and q.fileset in (self.vo_id,)]
+                     if q.storage['name'] == storage_name and q.fileset == self.vo_id]
             if quota:
                 logging.info("Setting the scratch quota for VO %s member %s to %d GiB on %s",
                              self.vo.vsc_id, member.account.vsc_id, quota[0].hard / 1024 / 1024, storage_name)
@@ -409,8 +444,8 @@ class VscTier2AccountpageVo(VscAccountPageVo, VscTier2Accountpage):
         """
 
         if name == 'dry_run':
-            for filesystem in self.storage[self.host_institute]:
-                self.storage[self.host_institute][filesystem].operator().dry_run = value
+            for filesystem in self.institute_storage:
+                self.institute_storage[filesystem].operator().dry_run = value
 
         super().__setattr__(name, value)
 
@@ -435,46 +470,63 @@ def update_vo_status(vo):
 
     payload = {"status": ACTIVE}
     try:
-        response = vo.rest_client.vo[vo.vo_id].patch(body=payload)
+        response = retry_request(vo.rest_client.vo[vo.vo_id].patch, body=payload)
     except HTTPError as err:
         logging.error("VO %s status was not changed", vo.vo_id)
-        raise VoStatusUpdateError(f"Vo %s status was not changed - received HTTP code {err.code}")
+        raise VoStatusUpdateError(f"VO {vo.vo_id} status was not changed - received HTTP code {err.code}")
     else:
-        virtual_organisation = mkVo(response)
+        virtual_organisation = mkVo(response[1])
         if virtual_organisation.status == ACTIVE:
             logging.info("VO %s status changed to %s", vo.vo_id, ACTIVE)
         else:
             logging.error("VO %s status was not changed", vo.vo_id)
-            raise UserStatusUpdateError(f"VO {vo.vo_id} status was not changed, still at {virtual_organisation.status}")
+            raise VoStatusUpdateError(f"VO {vo.vo_id} status was not changed, still at {virtual_organisation.status}")
 
 
-def process_vos(options, vo_ids, storage_name, client, datestamp, host_institute=GENT):
+def process_vos(options, vo_ids, storage_name, client, datestamp, host_institute=GENT, storage=None):
     """Process the virtual organisations.
 
     - make the fileset per VO
     - set the quota for the complete fileset
     - set the quota on a per-user basis for all VO members
+
+    @param storage: VscStorage instance to use for the VOs and their members, if None a fresh one is created
+                    and shared
     """
 
-    listm = Monoid([], lambda xs, ys: xs + ys)
-    ok_vos = MonoidDict(copy.deepcopy(listm))
-    error_vos = MonoidDict(copy.deepcopy(listm))
+    ok_vos = defaultdict(list)
+    error_vos = defaultdict(list)
 
-    for vo_id in sorted(vo_ids):
+    if storage_name == VSC_HOME:
+        # VOs have nothing on home, no need to set any of them up
+        return (ok_vos, error_vos)
 
-        vo = VscTier2AccountpageVo(vo_id, rest_client=client, host_institute=host_institute)
+    on_scratch = storage_name in VSC_PRODUCTION_SCRATCH[host_institute]
+
+    vos = []
+    for vo_id in sorted(vo_ids):
+        vo = VscTier2AccountpageVo(vo_id, storage=storage, rest_client=client, host_institute=host_institute)
         vo.dry_run = options.dry_run
+        # share the storage operators with the members and the next VOs, instead of setting up new ones each time
+        storage = vo.storage
+        vos.append(vo)
 
-        try:
-            if storage_name in [VSC_HOME]:
-                continue
+    # the account page lookups are independent for each VO, so get them concurrently up front,
+    # the changes on the filesystem below are still made one VO at a time
+    prefetch(lambda vo: vo._institute_quota, vos)
+    if storage_name == VSC_DATA_SHARED:
+        prefetch(lambda vo: vo.sharing_group, vos)
+
+    for vo in vos:
+        vo_id = vo.vo_id
 
-            if storage_name in [VSC_DATA] and vo_id not in DEFAULT_VOS_ALL:
+        try:
+            if storage_name == VSC_DATA and vo_id not in DEFAULT_VOS:
                 vo.create_data_fileset()
                 vo.set_data_quota()
                 update_vo_status(vo)
 
-            if storage_name in [VSC_DATA_SHARED] and vo_id not in DEFAULT_VOS_ALL and vo.data_sharing:
+            if storage_name == VSC_DATA_SHARED and vo_id not in DEFAULT_VOS and vo.data_sharing:
                 vo.create_data_shared_fileset()
                 vo.set_data_shared_quota()
 
@@ -482,39 +534,43 @@ def process_vos(options, vo_ids, storage_name, client, datestamp, host_institute
                 logging.info("Not deploying default VO %s members", vo_id)
                 continue
 
-            if storage_name in VSC_PRODUCTION_SCRATCH[host_institute]:
+            if on_scratch:
                 vo.create_scratch_fileset(storage_name)
                 vo.set_scratch_quota(storage_name)
 
-            if vo_id in DEFAULT_VOS_ALL and storage_name in (VSC_HOME, VSC_DATA):
+            if vo_id in DEFAULT_VOS and storage_name == VSC_DATA:
                 logging.info("Not deploying default VO %s members on %s", vo_id, storage_name)
                 continue
 
-            modified_member_list = client.vo[vo.vo_id].member.modified[datestamp].get()
-            factory = lambda vid: VscTier2AccountpageUser(vid,
-                                                          rest_client=client,
-                                                          host_institute=host_institute,
-                                                          use_user_cache=True)
-            modified_members = [factory(a["vsc_id"]) for a in modified_member_list[1]]
+            modified_member_list = retry_request(client.vo[vo.vo_id].member.modified[datestamp].get)
+            # the member listing holds the full account records, no need to fetch each of them again
+            factory = lambda account: VscTier2AccountpageUser(account["vsc_id"],
+                                                              storage=storage,
+                                                              rest_client=client,
+                                                              account=mkVscAccount(account),
+                                                              host_institute=host_institute,
+                                                              use_user_cache=True)
+            modified_members = [factory(a) for a in modified_member_list[1]]
 
             for member in modified_members:
                 try:
                     member.dry_run = options.dry_run
-                    if storage_name in [VSC_DATA]:
+                    if storage_name == VSC_DATA:
                         vo.set_member_data_quota(member)  # half of the VO quota
                         vo.create_member_data_dir(member)
 
-                    if storage_name in VSC_PRODUCTION_SCRATCH[host_institute]:
+                    if on_scratch:
                         vo.set_member_scratch_quota(storage_name, member)  # half of the VO quota
                         vo.create_member_scratch_dir(storage_name, member)
 
-                    ok_vos[vo.vo_id] = [member.account.vsc_id]
+                    ok_vos[vo.vo_id].append(member.account.vsc_id)
                 except Exception:
                     logging.exception("Failure at setting up the member %s of VO %s on %s",
                                       member.account.vsc_id, vo.vo_id, storage_name)
-                    error_vos[vo.vo_id] = [member.account.vsc_id]
+                    error_vos[vo.vo_id].append(member.account.vsc_id)
         except Exception:
             logging.exception("Something went wrong setting up the VO %s on the storage %s", vo.vo_id, storage_name)
-            error_vos[vo.vo_id] = vo.members()
+            # the failure may be the VO lookup itself, so only report the members if the VO was already fetched
+            error_vos[vo.vo_id].extend(vo._vo_cache.members if vo._vo_cache is not None else [])
 
     return (ok_vos, error_vos)
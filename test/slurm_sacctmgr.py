@@ -21,8 +21,8 @@ Tests for vsc.administration.slurm.*
 from vsc.install.testing import TestCase
 
 from vsc.administration.slurm.sacctmgr import (
-    parse_slurm_sacct_dump,
-    SacctMgrTypes, SlurmAccount, SlurmUser,
+    parse_slurm_sacct_dump, parse_slurm_sacct_line, positional_factory,
+    SacctMgrException, SacctMgrTypes, SlurmAccount, SlurmResource, SlurmUser,
     )
 
 
@@ -68,4 +68,93 @@ class SlurmSacctmgrTest(TestCase):
             SlurmUser(User='account3', Def_Acct='vo2', Admin='None', Cluster='banette', Account='vo2', Partition='', Share='1', MaxJobs='', MaxNodes='', MaxCPUs='', MaxSubmit='', MaxWall='', MaxCPUMins='', QOS='normal', Def_QOS=''),
         ]))
 
+    def test_parse_slurm_sacct_dump_iterable(self):
+        """Test that the listing can be any iterable of lines, including an empty one."""
 
+        sacctmgr_user_output = [
+            "User|Def Acct|Admin|Cluster|Account|Partition|Share|MaxJobs|MaxNodes|MaxCPUs|MaxSubmit|MaxWall|MaxCPUMins|QOS|Def QOS",
+            "root|root|Administrator|banette|root||1|||||||normal|",
+            "account1|vo1|None|banette|vo1||1|||||||normal|",
+            "account2|vo1|None|banette|vo1||1|||||||normal|",
+        ]
+
+        info = parse_slurm_sacct_dump((line for line in sacctmgr_user_output), SacctMgrTypes.users)
+
+        self.assertEqual(info, parse_slurm_sacct_dump(sacctmgr_user_output, SacctMgrTypes.users))
+        self.assertEqual(sorted(user.User for user in info), ['account1', 'account2'])
+
+        self.assertEqual(parse_slurm_sacct_dump([], SacctMgrTypes.users), set())
+        self.assertEqual(parse_slurm_sacct_dump(iter([]), SacctMgrTypes.accounts), set())
+
+    def test_parse_slurm_sacct_line(self):
+        """Test that single lines are parsed like the lines of a dump."""
+        header = ["User", "Def_Acct", "Admin", "Cluster", "Account", "Partition", "Share", "MaxJobs", "MaxNodes",
+                  "MaxCPUs", "MaxSubmit", "MaxWall", "MaxCPUMins", "QOS", "Def_QOS"]
+
+        user = parse_slurm_sacct_line(header, "account1|vo1|None|banette|vo1||1|||||||normal|\n", SacctMgrTypes.users)
+        self.assertEqual(user.User, 'account1')
+        self.assertEqual(user.Def_Acct, 'vo1')
+        self.assertEqual(user.Def_QOS, '')
+
+        self.assertEqual(parse_slurm_sacct_line(header, "root|root|Administrator|banette|root||1|||||||normal|",
+                                                SacctMgrTypes.users), None)
+        self.assertEqual(parse_slurm_sacct_line(header, "account1|vo1", "licenses"), None)
+
+    def test_parse_slurm_sacct_dump_exclude(self):
+        """Test that excluded accounts are skipped."""
+
+        sacctmgr_account_output = [
+            "Account|Descr|Org|Cluster|ParentName|User|Share|QOS|Def QOS",
+            "gent|gent|gent|banette|root||1|normal|",
+            "vo1|vo1|gent|banette|gent||1|normal|",
+            "vo2|vo2|gent|banette|gent||1|normal|",
+        ]
+
+        info = parse_slurm_sacct_dump(sacctmgr_account_output, SacctMgrTypes.accounts, exclude=['vo1'])
+
+        self.assertEqual(sorted(account.Account for account in info), ['gent', 'vo2'])
+
+    def test_parse_slurm_sacct_dump_unknown_type(self):
+        """Test that a listing of an unknown type is refused."""
+
+        sacctmgr_output = [
+            "Name|Priority",
+            "normal|0",
+        ]
+
+        self.assertRaises(SacctMgrException, parse_slurm_sacct_dump, sacctmgr_output, "licenses")
+
+    def test_positional_factory(self):
+        """Test that the fields are picked by their position in the header."""
+        header = ["Count", "Type", "Name", "Server", "Allocated", "ServerType"]
+        make = positional_factory(header, SlurmResource)
+
+        self.assertEqual(make(["5", "License", "mysoft", "flexlm", "0", "flexlm_server"]), SlurmResource(
+            Name='mysoft', Server='flexlm', Type='License', Count='5', Allocated='0', ServerType='flexlm_server'))
+
+        # fields missing at the end of a short line get the default
+        self.assertEqual(make(["5", "License", "mysoft"]), SlurmResource(
+            Name='mysoft', Server=None, Type='License', Count='5', Allocated=None, ServerType=None))
+
+        # fields missing from the header get the default
+        make = positional_factory(["Name", "Count", "Type"], SlurmResource)
+        self.assertEqual(make(["mysoft", "5", "License"]), SlurmResource(
+            Name='mysoft', Server=None, Type='License', Count='5', Allocated=None, ServerType=None))
+        self.assertEqual(make(["mysoft"]), SlurmResource(
+            Name='mysoft', Server=None, Type=None, Count=None, Allocated=None, ServerType=None))
+
+    def test_parse_slurm_sacct_dump_resource(self):
+        """Test that the resource count is turned into an int."""
+
+        sacctmgr_resource_output = [
+            "Name|Server|Type|Count|% Allocated|ServerType",
+            "mysoft|flexlm|License|715|100|flexlm",
+            "supersoft|flexlm|License|1|100|flexlm",
+        ]
+
+        info = parse_slurm_sacct_dump(sacctmgr_resource_output, SacctMgrTypes.resource)
+
+        self.assertEqual(info, set([
+            SlurmResource(Name='mysoft', Server='flexlm', Type='License', Count=715, Allocated=None, ServerType='flexlm'),
+            SlurmResource(Name='supersoft', Server='flexlm', Type='License', Count=1, Allocated=None, ServerType='flexlm'),
+        ]))
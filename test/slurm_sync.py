@@ -18,14 +18,17 @@ Tests for vsc.administration.slurm.*
 @author: Andy Georges (Ghent University)
 """
 import shlex
+import time
 
 from collections import namedtuple
 
+from mock import patch
 from vsc.install.testing import TestCase
 
 from vsc.administration.slurm.sacctmgr import SacctMgrTypes, SlurmUser
 
 from vsc.administration.slurm.sync import (
+    SCommandException, execute_commands,
     slurm_vo_accounts, slurm_user_accounts,
     slurm_institute_accounts, slurm_project_accounts, slurm_project_users_accounts,
     slurm_project_qos,
@@ -256,3 +259,58 @@ class SlurmSyncTestBrussel(TestCase):
             shlex.split("/usr/bin/sacctmgr -i add account bvo00005 Parent=brussel Organization=vub Cluster=mycluster Fairshare=14"),
             shlex.split("/usr/bin/sacctmgr -i add account bvo00006 Parent=brussel Organization=vub Cluster=mycluster Fairshare=13")
         ]])
+
+
+class SlurmExecuteCommandsTest(TestCase):
+    """Tests for running the Slurm commands"""
+
+    @patch('vsc.administration.slurm.sync.RunNoShell.run')
+    def test_execute_commands_sequential(self, mock_run):
+        """A single worker runs the commands in the given order"""
+        mock_run.return_value = (0, "")
+        commands = [["sacctmgr", "add", str(i)] for i in range(10)]
+
+        execute_commands(commands)
+        self.assertEqual([c[0][0] for c in mock_run.call_args_list], commands)
+
+        mock_run.reset_mock()
+        execute_commands(commands, max_workers=1)
+        self.assertEqual([c[0][0] for c in mock_run.call_args_list], commands)
+
+    @patch('vsc.administration.slurm.sync.RunNoShell.run')
+    def test_execute_commands_parallel(self, mock_run):
+        """Every command is run when several run at the same time"""
+        mock_run.return_value = (0, "")
+        commands = [["sacctmgr", "add", str(i)] for i in range(10)]
+
+        execute_commands(commands, max_workers=4)
+        self.assertEqual(sorted(c[0][0] for c in mock_run.call_args_list), sorted(commands))
+
+    @patch('vsc.administration.slurm.sync.RunNoShell.run')
+    def test_execute_commands_parallel_failure(self, mock_run):
+        """A failing command is raised and the commands that did not start yet are not run"""
+        def run(command):
+            # both workers are busy when the first command fails, the second one outlasts the failure
+            if command == ["sacctmgr", "fail"]:
+                time.sleep(0.05)
+                return (1, "error")
+            time.sleep(0.1)
+            return (0, "")
+
+        mock_run.side_effect = run
+        commands = [["sacctmgr", "fail"], ["sacctmgr", "slow"], ["sacctmgr", "add", "1"], ["sacctmgr", "add", "2"]]
+
+        self.assertRaises(SCommandException, execute_commands, commands, max_workers=2)
+        self.assertEqual(sorted(c[0][0] for c in mock_run.call_args_list),
+                         [["sacctmgr", "fail"], ["sacctmgr", "slow"]])
+
+    @patch('vsc.administration.slurm.sync.RunNoShell.run')
+    def test_execute_commands_allow_failure(self, mock_run):
+        """Failures are ignored when allowed, all commands still run"""
+        mock_run.return_value = (1, "error")
+        commands = [["scancel", str(i)] for i in range(5)]
+
+        execute_commands(commands, allow_failure=True, max_workers=3)
+        self.assertEqual(mock_run.call_count, 5)
+
+        self.assertRaises(SCommandException, execute_commands, commands[:1], max_workers=3)
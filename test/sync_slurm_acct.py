@@ -0,0 +1,92 @@
+#
+# Copyright 2013-2025 Ghent University
+#
+# This file is part of vsc-administration,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/vsc-administration
+#
+# All rights reserved.
+#
+"""
+Tests for the sync_slurm_acct script
+"""
+from datetime import timedelta
+
+from mock import MagicMock
+from vsc.config.base import GENT
+from vsc.install.testing import TestCase
+from vsc.utils.timestamp import convert_timestamp
+
+from sync_slurm_acct import FULL_SYNC_INTERVAL_MINUTES, SYNC_TIMESTAMP_OVERLAP, account_page_changed, sync_needed
+
+
+def mock_client(changed_vos, changed_accounts):
+    client = MagicMock()
+    client.vo.institute[GENT].modified.__getitem__.return_value.get.return_value = (200, changed_vos)
+    client.account.modified.__getitem__.return_value.get.return_value = (200, changed_accounts)
+    return client
+
+
+class TestSyncSlurmAcct(TestCase):
+
+    def test_account_page_changed(self):
+        """Any changed VO or account means the account page changed"""
+        self.assertFalse(account_page_changed(mock_client([], []), GENT, "20250101000000Z"))
+        self.assertTrue(account_page_changed(mock_client([{'vsc_id': 'gvo00002'}], []), GENT, "20250101000000Z"))
+        self.assertTrue(account_page_changed(mock_client([], [{'vsc_id': 'vsc40075'}]), GENT, "20250101000000Z"))
+
+    def test_sync_needed_full_sync(self):
+        """A forced full sync does not look at the account page"""
+        client = mock_client([], [])
+
+        self.assertTrue(sync_needed(client, GENT, "20250102000000Z", "20250102001000Z", full_sync=True))
+        client.account.modified.__getitem__.assert_not_called()
+
+    def test_sync_needed_interval(self):
+        """A sync is done when the last one is too long ago, even without changes"""
+        client = mock_client([], [])
+
+        self.assertTrue(sync_needed(client, GENT, "20250102000000Z", "20250102063000Z"))
+        client.account.modified.__getitem__.assert_not_called()
+
+        self.assertTrue(sync_needed(client, GENT, "20250102000000Z", "20250102001000Z",
+                                    full_sync_interval=timedelta(minutes=5)))
+        client.account.modified.__getitem__.assert_not_called()
+
+    def test_sync_needed_changes(self):
+        """Within the interval, only sync when something changed since the last sync minus the overlap"""
+        last_timestamp = "20250102000000Z"
+        (_, changed_timestamp) = convert_timestamp(convert_timestamp(last_timestamp)[0] - SYNC_TIMESTAMP_OVERLAP)
+
+        client = mock_client([], [])
+        self.assertFalse(sync_needed(client, GENT, last_timestamp, "20250102001000Z"))
+        client.vo.institute[GENT].modified.__getitem__.assert_called_with(changed_timestamp)
+        client.account.modified.__getitem__.assert_called_with(changed_timestamp)
+
+        client = mock_client([], [{'vsc_id': 'vsc40075'}])
+        self.assertTrue(sync_needed(client, GENT, last_timestamp, "20250102001000Z"))
+
+    def test_sync_needed_skip(self):
+        """Runs from cron without changes in the account page skip the sync until the full sync interval passed"""
+        last_timestamp = "20250102000000Z"
+        client = mock_client([], [])
+
+        # runs every 15 minutes after the last sync
+        for minutes in range(15, FULL_SYNC_INTERVAL_MINUTES, 15):
+            (_, start_time) = convert_timestamp(convert_timestamp(last_timestamp)[0] + timedelta(minutes=minutes))
+            self.assertFalse(sync_needed(client, GENT, last_timestamp, start_time))
+
+        # the changes are only looked for a little before the last sync, not since the changes synced before it
+        (_, changed_timestamp) = convert_timestamp(convert_timestamp(last_timestamp)[0] - SYNC_TIMESTAMP_OVERLAP)
+        client.account.modified.__getitem__.assert_called_with(changed_timestamp)
+
+        (_, start_time) = convert_timestamp(convert_timestamp(last_timestamp)[0] +
+                                            timedelta(minutes=FULL_SYNC_INTERVAL_MINUTES))
+        client.reset_mock()
+        self.assertTrue(sync_needed(client, GENT, last_timestamp, start_time))
+        client.account.modified.__getitem__.assert_not_called()
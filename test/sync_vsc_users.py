@@ -0,0 +1,123 @@
+#
+# Copyright 2013-2025 Ghent University
+#
+# This file is part of vsc-administration,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/vsc-administration
+#
+# All rights reserved.
+#
+"""
+Tests for the sync_vsc_users script
+"""
+import os
+
+import mock
+from mock import patch
+
+import vsc.config.base as config
+
+from vsc.administration.base import make_storage
+from vsc.config.base import GENT, VSC_DATA, VSC_HOME, VscStorage
+from vsc.install.testing import TestCase
+
+import sync_vsc_users
+from sync_vsc_users import run_per_storage
+
+# monkey patch location of storage configuration file to included test config
+config.STORAGE_CONFIGURATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filesystem_info.conf')
+
+
+class TestSyncVscUsers(TestCase):
+
+    def test_make_storage(self):
+        """The copy of the storage configuration does not carry the operators of the shared one"""
+        home = VscStorage()[GENT][VSC_HOME]
+        operator = mock.MagicMock()
+
+        with patch.object(home, 'operator', operator, create=True):
+            storage = make_storage(GENT)
+
+            self.assertFalse(storage is VscStorage())
+            self.assertEqual(storage[GENT][VSC_HOME].filesystem, home.filesystem)
+            self.assertEqual(storage[GENT][VSC_HOME].operator, None)
+            self.assertTrue(home.operator is operator)
+
+    def test_run_per_storage(self):
+        """Every storage gets its own call, the results keep the order of the storages"""
+        function = mock.MagicMock(side_effect=lambda storage_name, *args: (storage_name, args))
+
+        self.assertEqual(run_per_storage(function, [VSC_HOME, VSC_DATA], 'options', 42), [
+            (VSC_HOME, (VSC_HOME, ('options', 42))),
+            (VSC_DATA, (VSC_DATA, ('options', 42))),
+        ])
+        self.assertEqual(function.call_count, 2)
+        self.assertEqual(run_per_storage(function, []), [])
+
+    def test_run_per_storage_exception(self):
+        """A crash on one storage is raised, after the other storages are done"""
+        done = []
+
+        def function(storage_name):
+            if storage_name == VSC_HOME:
+                raise Exception("storage backend is gone")
+            done.append(storage_name)
+
+        self.assertRaises(Exception, run_per_storage, function, [VSC_HOME, VSC_DATA])
+        self.assertEqual(done, [VSC_DATA])
+
+    def run_main(self, sync_results):
+        """Run main for users on VSC_HOME and VSC_DATA, with the given results of sync_users by storage"""
+        with patch('sync_vsc_users.ExtendedSimpleOption') as mock_opts, \
+                patch('sync_vsc_users.retrieve_timestamp_with_default') as mock_retrieve, \
+                patch('sync_vsc_users.make_client') as mock_client, \
+                patch('sync_vsc_users.sync_users') as mock_sync_users, \
+                patch('sync_vsc_users.write_timestamp') as mock_write:
+            options = mock_opts.return_value.options
+            options.storage = [VSC_HOME, VSC_DATA]
+            options.user = True
+            options.vo = False
+            options.dry_run = False
+            options.start_timestamp = None
+            options.host_institute = GENT
+
+            mock_retrieve.return_value = ("20250101000000Z", "20250102000000Z")
+            mock_client.return_value.account.institute[GENT].modified.__getitem__.return_value.get.return_value = (
+                200, [{'vsc_id': 'vsc40075'}, {'vsc_id': 'vsc40023'}])
+            mock_sync_users.side_effect = lambda storage_name, *args: sync_results[storage_name]
+
+            sync_vsc_users.main()
+
+            self.assertEqual(sorted(c[0][0] for c in mock_sync_users.call_args_list), sorted([VSC_DATA, VSC_HOME]))
+            stats = mock_opts.return_value.epilogue.call_args[0][1]
+
+            return (stats, mock_write)
+
+    def test_main(self):
+        """The timestamp is written when all storages are in sync"""
+        (stats, mock_write) = self.run_main({
+            VSC_HOME: ((['vsc40075', 'vsc40023'], []), ([], [])),
+            VSC_DATA: ((['vsc40075', 'vsc40023'], []), (['vsc40075'], [])),
+        })
+
+        self.assertEqual(stats[f"{VSC_HOME}_users_sync"], 2)
+        self.assertEqual(stats[f"{VSC_DATA}_quota_sync"], 1)
+        mock_write.assert_called_once_with(sync_vsc_users.SYNC_TIMESTAMP_FILENAME, mock.ANY)
+
+    def test_main_failure(self):
+        """A failure on one storage keeps the timestamp, the other storages are still synced"""
+        (stats, mock_write) = self.run_main({
+            VSC_HOME: ((['vsc40075'], ['vsc40023']), ([], [])),
+            VSC_DATA: ((['vsc40075', 'vsc40023'], []), ([], [])),
+        })
+
+        self.assertEqual(stats[f"{VSC_HOME}_users_sync"], 1)
+        self.assertEqual(stats[f"{VSC_HOME}_users_sync_fail"], 1)
+        self.assertEqual(stats[f"{VSC_DATA}_users_sync"], 2)
+        self.assertEqual(stats[f"{VSC_DATA}_users_sync_fail"], 0)
+        mock_write.assert_not_called()
@@ -0,0 +1,113 @@
+#
+# Copyright 2012-2025 Ghent University
+#
+# This file is part of vsc-administration,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/vsc-administration
+#
+# All rights reserved.
+#
+"""
+Tests for vsc.administration.tools
+"""
+import threading
+import time
+
+import mock
+
+from urllib.error import HTTPError, URLError
+
+from vsc.install.testing import TestCase
+
+from vsc.administration.tools import MAX_PARALLEL_REQUESTS, RETRY_ATTEMPTS, prefetch, retry_request
+
+
+def http_error(code, headers=None):
+    return HTTPError("https://account.example.org/api/", code, "failed", headers or {}, None)
+
+
+class RetryRequestTest(TestCase):
+    """Tests for retrying account page requests"""
+
+    @mock.patch('vsc.administration.tools.time.sleep')
+    def test_success(self, mock_sleep):
+        request = mock.MagicMock(return_value=(200, ['vsc40075']))
+
+        self.assertEqual(retry_request(request), (200, ['vsc40075']))
+        request.assert_called_once_with()
+        mock_sleep.assert_not_called()
+
+    @mock.patch('vsc.administration.tools.time.sleep')
+    def test_transient_failures(self, mock_sleep):
+        request = mock.MagicMock(side_effect=[
+            http_error(503),
+            URLError("connection refused"),
+            http_error(429, {'Retry-After': '7'}),
+            (200, []),
+        ])
+
+        self.assertEqual(retry_request(request), (200, []))
+        self.assertEqual(request.call_count, 4)
+        self.assertEqual(mock_sleep.call_count, 3)
+        # the Retry-After header is honoured
+        mock_sleep.assert_called_with(7)
+
+    @mock.patch('vsc.administration.tools.time.sleep')
+    def test_permanent_failure(self, mock_sleep):
+        request = mock.MagicMock(side_effect=http_error(404))
+
+        self.assertRaises(HTTPError, retry_request, request)
+        request.assert_called_once_with()
+        mock_sleep.assert_not_called()
+
+    @mock.patch('vsc.administration.tools.time.sleep')
+    def test_give_up(self, mock_sleep):
+        request = mock.MagicMock(side_effect=http_error(502))
+
+        self.assertRaises(HTTPError, retry_request, request)
+        self.assertEqual(request.call_count, RETRY_ATTEMPTS)
+        self.assertEqual(mock_sleep.call_count, RETRY_ATTEMPTS - 1)
+
+
+class PrefetchTest(TestCase):
+    """Tests for prefetching account page data"""
+
+    def test_prefetch(self):
+        """Every item is fetched, failures are ignored"""
+        fetched = []
+
+        def fetch(item):
+            if item == 'gvo00003':
+                raise Exception("no such vo")
+            fetched.append(item)
+
+        prefetch(fetch, ['gvo00002', 'gvo00003', 'gvo00004'])
+        self.assertEqual(sorted(fetched), ['gvo00002', 'gvo00004'])
+
+    def test_prefetch_limit(self):
+        """Concurrent prefetches together stay within MAX_PARALLEL_REQUESTS"""
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def fetch(item):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        threads = [threading.Thread(target=prefetch, args=(fetch, range(2 * MAX_PARALLEL_REQUESTS)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(peak[0] <= MAX_PARALLEL_REQUESTS)
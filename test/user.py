@@ -21,9 +21,11 @@ Tests for vsc.administration.user
 import os
 
 from collections import namedtuple
+from urllib.error import HTTPError
 
 import mock
 
+import vsc.administration.base as base
 import vsc.administration.user as user
 import vsc.config.base as config
 
@@ -400,6 +402,22 @@ class VscAccountPageUserTest(TestCase):
 
             self.assertEqual(accountpageuser.person, test_account.person)
 
+    @mock.patch('vsc.administration.tools.time.sleep')
+    def test_account_retry(self, mock_sleep):
+        """A transient account page failure is retried"""
+        mock_client = mock.MagicMock()
+        test_account = mkVscAccount(test_account_1)
+        mock_client.account[test_account.vsc_id].get.side_effect = [
+            HTTPError("https://account.example.org/api/", 503, "unavailable", {}, None),
+            (200, test_account_1),
+        ]
+
+        accountpageuser = user.VscAccountPageUser(test_account.vsc_id, mock_client)
+
+        self.assertEqual(accountpageuser.account, test_account)
+        self.assertEqual(mock_client.account[test_account.vsc_id].get.call_count, 2)
+        self.assertEqual(mock_sleep.call_count, 1)
+
     def test_usergroup_instantiation(self):
 
         mock_client = mock.MagicMock()
@@ -471,11 +489,11 @@ class VscTier2AccountpageUserTest(TestCase):
 
             self.assertEqual(
                 accountpageuser.user_home_quota,
-                [q['hard'] for q in quota if q['storage']['name'] == 'VSC_HOME' and q['fileset'] == fileset][0]
+                next(q['hard'] for q in quota if q['storage']['name'] == 'VSC_HOME' and q['fileset'] == fileset)
             )
             self.assertEqual(
                 accountpageuser.user_data_quota,
-                [q['hard'] for q in quota if q['storage']['name'] == 'VSC_DATA' and q['fileset'] == fileset][0]
+                next(q['hard'] for q in quota if q['storage']['name'] == 'VSC_DATA' and q['fileset'] == fileset)
             )
             self.assertEqual(
                 [(q.fileset, q.hard, q.storage['name']) for q in accountpageuser.user_scratch_quota],
@@ -636,3 +654,37 @@ class UserDeploymentTest(TestCase):
 
                         mock_user_instance.set_home_quota.assert_not_called()
                         mock_user_instance.set_data_quota.assert_not_called()
+
+
+class VscTier2AccountpageTest(TestCase):
+    """Tests for the common storage handling."""
+
+    def create_filesets(self, dry_run):
+        """Create two filesets through two accountpage objects that share the storage and return the operator"""
+        with mock.patch('vsc.administration.base.StorageOperator'):
+            storage = base.make_storage(GENT)
+            accountpages = [base.VscTier2Accountpage(storage=storage, host_institute=GENT) for _ in range(2)]
+
+        data = storage[GENT][VSC_DATA]
+        operator = data.operator()
+        operator.dry_run = dry_run
+        operator.get_fileset_info.return_value = None
+
+        for (accountpage, fileset_name) in zip(accountpages, ["gvo00002", "gvo00003"]):
+            accountpage._create_fileset(data, f"/test/data/{fileset_name}", fileset_name)
+
+        self.assertEqual(operator.make_fileset.call_count, 2)
+        return operator
+
+    def test_create_fileset_shared_operator(self):
+        """A shared operator is listed once up front, and again after each new fileset"""
+        operator = self.create_filesets(dry_run=False)
+
+        self.assertEqual(operator.list_filesets.call_args_list,
+                         [mock.call(), mock.call(update=True), mock.call(update=True)])
+
+    def test_create_fileset_shared_operator_dry_run(self):
+        """In a dry run, the filesets are not listed again"""
+        operator = self.create_filesets(dry_run=True)
+
+        self.assertEqual(operator.list_filesets.call_args_list, [mock.call()])
@@ -22,10 +22,12 @@ import os
 import pwd
 
 from collections import namedtuple
+from urllib.error import HTTPError
 
 import mock
 from mock import patch
 
+import vsc.administration.user as user
 import vsc.administration.vo as vo
 import vsc.config.base as config
 
@@ -304,7 +306,8 @@ class VoDeploymentTest(TestCase):
         v = mock.MagicMock()
         mc.vo[test_vo_id].get.return_value = v
 
-        with patch('vsc.administration.vo.mkVscAccount') as mock_mkvscaccount:
+        # the moderator account is fetched through the user cache
+        with patch('vsc.administration.user.mkVscAccount') as mock_mkvscaccount:
             mock_mkvscaccount.side_effect = IndexError("Nope")
 
             with patch('vsc.administration.base.StorageOperator') as mock_storage_operator:
@@ -334,6 +337,137 @@ class VoDeploymentTest(TestCase):
 
                         test_vo.create_data_shared_fileset()
 
+                        # no moderator available, so the fileset is owned by nobody
+                        mock_storage_operator.return_value.chown.assert_called_once_with(
+                            vo._nobody_uid(), 123456, mock.ANY
+                        )
+
+    def test_moderator_fetched_once(self):
+        """A moderator of several VOs is only fetched once from the account page"""
+        moderator_id = "vsc40999"
+
+        mc = mock.MagicMock()
+        mc.account[moderator_id].get.return_value = (200, {'vsc_id': moderator_id})
+
+        with patch('vsc.administration.user.mkVscAccount') as mock_mkvscaccount:
+            mock_mkvscaccount.return_value = mock.MagicMock(vsc_id=moderator_id, vsc_id_number=2540999)
+
+            with patch.dict(user._users_cache['VscAccountPageUser'], clear=True):
+                with patch('vsc.administration.base.StorageOperator') as mock_storage_operator:
+                    mock_storage_operator.return_value = mock.MagicMock()
+
+                    s = config.VscStorage()
+                    for storage in s[GENT]:
+                        s[GENT][storage].operator = mock_storage_operator
+
+                    with patch("vsc.administration.vo.VscTier2AccountpageVo.vo",
+                               new_callable=mock.PropertyMock) as mock_vo:
+                        for (vo_id, vo_id_number) in [("gvo00101", 2640101), ("gvo00102", 2640102)]:
+                            mock_vo.return_value = mock.MagicMock(
+                                vsc_id=vo_id,
+                                vsc_id_number=vo_id_number,
+                                moderators=[moderator_id],
+                            )
+                            test_vo = vo.VscTier2AccountpageVo(vo_id, storage=s, rest_client=mc)
+                            test_vo._create_vo_fileset(s[GENT][VSC_DATA], f"/test/data/{vo_id}")
+
+                            mock_storage_operator.return_value.chown.assert_called_with(
+                                2540999, vo_id_number, f"/test/data/{vo_id}"
+                            )
+
+        mc.account[moderator_id].get.assert_called_once_with()
+
+    def test_process_vos_prefetch_failure(self):
+        """A VO whose account page lookup fails is reported with its members, the other VOs are still set up"""
+        Options = namedtuple("Options", ['dry_run'])
+        options = Options(dry_run=False)
+        date = "20321231"
+
+        vo_clients = {}
+        for (vo_id, members) in [("gvo00002", ["vsc40075"]), ("gvo00003", ["vsc40023", "vsc40024"])]:
+            vo_clients[vo_id] = mock.MagicMock()
+            vo_clients[vo_id].get.return_value = (200, {'vsc_id': vo_id, 'members': members})
+            vo_clients[vo_id].member.modified[date].get.return_value = (200, [])
+        vo_clients["gvo00002"].quota.get.return_value = (200, [])
+        vo_clients["gvo00003"].quota.get.side_effect = HTTPError("https://account.example.org/api/", 404,
+                                                                 "not found", {}, None)
+
+        mc = mock.MagicMock()
+        mc.vo.__getitem__.side_effect = vo_clients.__getitem__
+
+        with patch('vsc.administration.base.StorageOperator'), \
+                patch('vsc.administration.vo.mkVo') as mock_mkvo, \
+                patch('vsc.administration.vo.update_vo_status') as mock_update_vo_status, \
+                patch.object(vo.VscTier2AccountpageVo, 'create_data_fileset', autospec=True) as mock_create, \
+                patch.object(vo.VscTier2AccountpageVo, 'set_data_quota', autospec=True,
+                             side_effect=lambda self: self._institute_quota):
+            mock_mkvo.side_effect = lambda v: mock.MagicMock(vsc_id=v['vsc_id'], members=v['members'])
+
+            (ok, errors) = vo.process_vos(options, ["gvo00003", "gvo00002"], VSC_DATA, mc, date)
+
+        self.assertEqual(dict(errors), {"gvo00003": ["vsc40023", "vsc40024"]})
+        self.assertEqual(dict(ok), {})
+        self.assertEqual(sorted(c[0][0].vo_id for c in mock_create.call_args_list), ["gvo00002", "gvo00003"])
+        self.assertEqual([c[0][0].vo_id for c in mock_update_vo_status.call_args_list], ["gvo00002"])
+        # the failed prefetch is not retried on the spot, the VO runs into it again when it is set up
+        self.assertEqual(vo_clients["gvo00003"].quota.get.call_count, 2)
+
+    def test_process_vos_lookup_failure(self):
+        """A VO that cannot be fetched from the account page is reported without members, the next VO is still set up"""
+        Options = namedtuple("Options", ['dry_run'])
+        options = Options(dry_run=False)
+        date = "20321231"
+
+        vo_clients = {}
+        for vo_id in ["gvo00002", "gvo00003"]:
+            vo_clients[vo_id] = mock.MagicMock()
+            vo_clients[vo_id].member.modified[date].get.return_value = (200, [])
+            vo_clients[vo_id].quota.get.return_value = (200, [])
+        vo_clients["gvo00002"].get.side_effect = HTTPError("https://account.example.org/api/", 404,
+                                                           "not found", {}, None)
+        vo_clients["gvo00003"].get.return_value = (200, {'vsc_id': "gvo00003", 'members': ["vsc40075"]})
+
+        mc = mock.MagicMock()
+        mc.vo.__getitem__.side_effect = vo_clients.__getitem__
+
+        with patch('vsc.administration.base.StorageOperator'), \
+                patch('vsc.administration.vo.mkVo') as mock_mkvo, \
+                patch('vsc.administration.vo.update_vo_status') as mock_update_vo_status, \
+                patch.object(vo.VscTier2AccountpageVo, 'create_data_fileset', autospec=True), \
+                patch.object(vo.VscTier2AccountpageVo, 'set_data_quota', autospec=True,
+                             side_effect=lambda self: self._institute_quota):
+            mock_mkvo.side_effect = lambda v: mock.MagicMock(vsc_id=v['vsc_id'], members=v['members'])
+
+            (ok, errors) = vo.process_vos(options, ["gvo00002", "gvo00003"], VSC_DATA, mc, date)
+
+        self.assertEqual(dict(errors), {"gvo00002": []})
+        self.assertEqual([c[0][0].vo_id for c in mock_update_vo_status.call_args_list], ["gvo00003"])
+        vo_clients["gvo00003"].member.modified[date].get.assert_called_once_with()
+
+    def test_update_vo_status(self):
+        """A VO status that is not changed raises a VoStatusUpdateError"""
+        test_vo = mock.MagicMock(vo_id="gvo00002", dry_run=False)
+        test_vo.vo.status = config.NEW
+        patch_status = test_vo.rest_client.vo["gvo00002"].patch
+
+        with patch("vsc.administration.vo.mkVo") as mock_mkvo:
+            patch_status.return_value = (200, {'vsc_id': "gvo00002", 'status': config.ACTIVE})
+            mock_mkvo.return_value = mock.MagicMock(status=config.ACTIVE)
+            vo.update_vo_status(test_vo)
+            patch_status.assert_called_once_with(body={"status": config.ACTIVE})
+            mock_mkvo.assert_called_once_with({'vsc_id': "gvo00002", 'status': config.ACTIVE})
+
+            mock_mkvo.return_value = mock.MagicMock(status=config.NEW)
+            self.assertRaises(vo.VoStatusUpdateError, vo.update_vo_status, test_vo)
+
+        patch_status.side_effect = HTTPError("https://account.example.org/api/", 404, "not found", {}, None)
+        try:
+            vo.update_vo_status(test_vo)
+        except vo.VoStatusUpdateError as err:
+            self.assertEqual(str(err), "VO gvo00002 status was not changed - received HTTP code 404")
+        else:
+            self.fail("VoStatusUpdateError not raised")
+
     @patch("vsc.accountpage.client.AccountpageClient", autospec=True)
     def test_process_brussel_vo(self, mock_client):
         """Test to see deploying a Brussel VO works fine"""